@@ -0,0 +1,200 @@
+"""
+Factory for tuned Kubernetes API clients.
+
+The Kubernetes client's defaults are a small connection pool and no request
+timeouts at all, so a slow or wedged apiserver looks like a hang. Clients
+created by new_api_client() share pool and timeout settings, enable TCP
+keep-alive, and record the latency of every request by verb and resource
+into a shared ApiMetrics instance.
+"""
+import bisect
+import dataclasses
+import logging
+import re
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import kubernetes.client  # type: ignore
+import kubernetes.config  # type: ignore
+import urllib3
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@dataclasses.dataclass(frozen=True)
+class ApiClientSettings:
+    # pool_size is the maximum number of concurrent connections to the
+    # apiserver.
+    pool_size: int = 16
+    # connect_timeout is the number of seconds to wait for a connection.
+    connect_timeout: float = 5.0
+    # read_timeout is the number of seconds to wait for a response. Watches
+    # and other streaming requests are not subject to this timeout.
+    read_timeout: float = 60.0
+    # keep_alive enables TCP keep-alive on pooled connections, so that idle
+    # connections to a vanished apiserver are detected.
+    keep_alive: bool = True
+
+
+class ApiMetrics:
+    """
+    Thread-safe latency histograms of API requests, keyed by verb and
+    resource.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._samples: Dict[Tuple[str, str], List[float]] = {}
+
+    def record(self, verb: str, resource: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault((verb, resource), []).append(seconds)
+
+    def summary(self, *, histograms: bool) -> List[str]:
+        """
+        Return a human-readable summary of request latencies, optionally with
+        a histogram for each verb and resource.
+        """
+        with self._lock:
+            samples = {k: sorted(v) for k, v in self._samples.items()}
+        if not samples:
+            return []
+        total = sum(len(v) for v in samples.values())
+        lines = [f"Kubernetes API latency ({total} request(s)):"]
+        for (verb, resource), latencies in sorted(samples.items()):
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            lines.append(
+                f"  {verb:<7} {resource:<40} count={len(latencies):<5} p50={p50 * 1000:.0f}ms p95={p95 * 1000:.0f}ms max={latencies[-1] * 1000:.0f}ms"
+            )
+            if not histograms:
+                continue
+            counts = [0] * (len(BUCKETS) + 1)
+            for latency in latencies:
+                counts[bisect.bisect_left(BUCKETS, latency)] += 1
+            for bound, count in zip((*BUCKETS, float("inf")), counts):
+                if count:
+                    histogram = "#" * max(1, round(40 * count / len(latencies)))
+                    lines.append(f"    <= {bound:>5}s {count:>5} {histogram}")
+        return lines
+
+    def log_summary(self, logger: logging.Logger, *, histograms: bool) -> None:
+        for line in self.summary(histograms=histograms):
+            logger.info(line)
+
+
+METRICS = ApiMetrics()
+
+# Query parameters which make a request stream its response
+_STREAM_PARAMS = frozenset(["watch", "follow"])
+_API_PATH = re.compile(r"^/(?:api/[^/]+|apis/[^/]+/[^/]+)/(?P<rest>[^?]*)")
+
+
+def _describe_request(method: str, url: str, query_params: Any) -> Tuple[str, str]:
+    """
+    Derive a Kubernetes verb and resource from a request's method and URL,
+    e.g. ("list", "pods") or ("get", "customresourcedefinitions").
+    """
+    path = urllib3.util.parse_url(url).path or ""
+    match = _API_PATH.match(path)
+    if not match:
+        return method.lower(), path
+    segments = [s for s in match.group("rest").split("/") if s]
+    if len(segments) > 2 and segments[0] == "namespaces":
+        # Namespaced resource
+        segments = segments[2:]
+    if not segments:
+        return method.lower(), path
+    resource = segments[0]
+    if len(segments) > 2:
+        # Subresource such as pods/exec or deployments/status
+        resource += f"/{segments[2]}"
+    verb = {
+        "POST": "create",
+        "PUT": "update",
+        "PATCH": "patch",
+        "DELETE": "delete",
+    }.get(method.upper(), "get")
+    if verb == "get" and len(segments) == 1:
+        verb = "list"
+    if verb == "list" and any(
+        k == "watch" and str(v).lower() == "true" for k, v in query_params or ()
+    ):
+        verb = "watch"
+    return verb, resource
+
+
+def _is_stream(query_params: Any) -> bool:
+    return any(
+        k in _STREAM_PARAMS and str(v).lower() == "true" for k, v in query_params or ()
+    )
+
+
+class InstrumentedApiClient(kubernetes.client.ApiClient):
+    """
+    ApiClient which applies default timeouts and records request latency.
+    """
+
+    def __init__(
+        self,
+        configuration: kubernetes.client.Configuration,
+        *,
+        settings: ApiClientSettings,
+        metrics: ApiMetrics,
+    ) -> None:
+        super().__init__(configuration)
+        self.settings = settings
+        self.metrics = metrics
+
+    def request(  # type: ignore
+        self, method: str, url: str, *args: Any, **kwargs: Any
+    ) -> Any:
+        # Responses which are not preloaded are not necessarily streams, e.g.
+        # the dynamic client never preloads them
+        if kwargs.get("_request_timeout") is None and not _is_stream(
+            kwargs.get("query_params")
+        ):
+            kwargs["_request_timeout"] = (
+                self.settings.connect_timeout,
+                self.settings.read_timeout,
+            )
+        verb, resource = _describe_request(method, url, kwargs.get("query_params"))
+        started = time.perf_counter()
+        try:
+            return super().request(method, url, *args, **kwargs)
+        finally:
+            self.metrics.record(verb, resource, time.perf_counter() - started)
+
+
+def new_api_client(
+    *,
+    config_file: Optional[str] = None,
+    context: Optional[str] = None,
+    settings: ApiClientSettings = ApiClientSettings(),
+    metrics: ApiMetrics = METRICS,
+) -> kubernetes.client.ApiClient:
+    """
+    Create an API client for the given kubeconfig file and context. If no
+    file is given, the default kubeconfig is used.
+    """
+    configuration = kubernetes.client.Configuration()
+    kubernetes.config.load_kube_config(
+        config_file=config_file,
+        context=context,
+        client_configuration=configuration,
+    )
+    configuration.connection_pool_maxsize = settings.pool_size
+    api_client = InstrumentedApiClient(
+        configuration, settings=settings, metrics=metrics
+    )
+    if settings.keep_alive:
+        # Older clients ignore configuration.socket_options, so set them on
+        # the pool manager, which passes them to each new connection
+        api_client.rest_client.pool_manager.connection_pool_kw["socket_options"] = [
+            *urllib3.connection.HTTPConnection.default_socket_options,
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+    return api_client
@@ -0,0 +1,196 @@
+"""
+Classification of kubectl apply failures.
+
+Some failures can never succeed on retry, such as an invalid object or an
+admission webhook denying a request, and should fail the deploy immediately.
+Others are transient, such as the apiserver being briefly unreachable, and are
+retried with backoff.
+
+A common transient failure on a fresh cluster is an admission webhook which
+is not ready yet, e.g. the cert-manager webhook while ClusterIssuers are being
+applied. Rather than retrying blindly, wait_for_webhooks() waits for the
+endpoints of the Services backing the webhook to become ready.
+"""
+import logging
+import re
+from typing import Iterable, Optional, Set, Tuple
+
+import kubernetes.client  # type: ignore
+import kubernetes.watch  # type: ignore
+
+# Transient failures which would otherwise match a permanent pattern, e.g. a
+# Forbidden error because the object's Namespace is still being deleted, or a
+# validation error because the apiserver could not be reached
+_TRANSIENT = [
+    re.compile(p, re.MULTILINE)
+    for p in (
+        r"because it is being terminated",
+        r"no matches for kind",
+        r"ensure CRDs are installed first",
+        r"connection refused",
+        r"failed to download openapi",
+        r"i/o timeout",
+        r"TLS handshake timeout",
+        r"\bEOF\b",
+    )
+]
+_PERMANENT = [
+    re.compile(p, re.MULTILINE)
+    for p in (
+        r"Error from server \((BadRequest|Invalid|Forbidden|Unauthorized|MethodNotAllowed|NotAcceptable|RequestEntityTooLarge|UnsupportedMediaType)\)",
+        r"^The \S+ \"[^\"]+\" is invalid:",
+        r"admission webhook \"[^\"]+\" denied the request",
+        r"^error: error (validating|parsing)",
+        r"field is immutable",
+        r"strict decoding error",
+        r"unknown field",
+    )
+]
+_WEBHOOK = re.compile(r"failed calling webhook \"(?P<name>[^\"]+)\"")
+_WEBHOOK_SERVICE = re.compile(
+    r"failed calling webhook \"[^\"]+\": .*?https://(?P<name>[a-z0-9-]+)\.(?P<namespace>[a-z0-9-]+)\.svc\b"
+)
+
+Service = Tuple[str, str]
+
+
+class ApplyError(Exception):
+    def __init__(self, stderr: str) -> None:
+        lines = [line for line in stderr.splitlines() if line.strip()]
+        super().__init__(f"kubectl apply failed: {lines[0] if lines else stderr}")
+        self.stderr = stderr
+
+
+class PermanentApplyError(ApplyError):
+    pass
+
+
+class TransientApplyError(ApplyError):
+    pass
+
+
+class WebhookNotReadyError(TransientApplyError):
+    def __init__(self, stderr: str, *, webhooks: Set[str], services: Set[Service]):
+        super().__init__(stderr)
+        # webhooks is the set of names of webhooks which could not be called.
+        self.webhooks = webhooks
+        # services is the set of (namespace, name) of the Services backing
+        # those webhooks, where the error message names them.
+        self.services = services
+        # waited is set if a wait for the Services' endpoints succeeded, in
+        # which case the apply can be retried without backing off.
+        self.waited = False
+
+
+def classify_apply_error(stderr: str) -> ApplyError:
+    """
+    Classify a kubectl apply failure from its stderr. Failures not known to
+    be permanent are assumed to be transient.
+    """
+    if not any(p.search(stderr) for p in _TRANSIENT) and any(
+        p.search(stderr) for p in _PERMANENT
+    ):
+        return PermanentApplyError(stderr)
+    webhooks = {m.group("name") for m in _WEBHOOK.finditer(stderr)}
+    if webhooks:
+        services = {
+            (m.group("namespace"), m.group("name"))
+            for m in _WEBHOOK_SERVICE.finditer(stderr)
+        }
+        return WebhookNotReadyError(stderr, webhooks=webhooks, services=services)
+    return TransientApplyError(stderr)
+
+
+def _webhook_services(
+    webhooks: Set[str],
+    *,
+    admission_api: kubernetes.client.AdmissionregistrationV1Api,
+) -> Set[Service]:
+    """
+    Return the Services backing the given webhooks according to the
+    webhook configurations.
+    """
+    services = set()
+    configurations: Iterable = [
+        *admission_api.list_validating_webhook_configuration().items,
+        *admission_api.list_mutating_webhook_configuration().items,
+    ]
+    for configuration in configurations:
+        for webhook in configuration.webhooks or []:
+            service = webhook.client_config.service
+            if webhook.name in webhooks and service is not None:
+                services.add((service.namespace, service.name))
+    return services
+
+
+def _has_ready_addresses(endpoints: Optional[kubernetes.client.V1Endpoints]) -> bool:
+    return endpoints is not None and any(
+        subset.addresses for subset in endpoints.subsets or []
+    )
+
+
+def _wait_for_endpoints(
+    service: Service,
+    *,
+    core_api: kubernetes.client.CoreV1Api,
+    timeout: int,
+    logger: logging.Logger,
+) -> bool:
+    """
+    Wait for the given Service to have at least one ready endpoint.
+
+    :return: True if the Service became ready while waiting, False if it was
+    already ready or the wait timed out.
+    """
+    namespace, name = service
+    try:
+        endpoints = core_api.read_namespaced_endpoints(name, namespace)
+    except kubernetes.client.rest.ApiException as e:
+        if e.status != 404:
+            raise
+        endpoints = None
+    if _has_ready_addresses(endpoints):
+        return False
+
+    logger.info(f"Waiting for endpoints of Service {name} in Namespace {namespace}...")
+    watch = kubernetes.watch.Watch()
+    for event in watch.stream(
+        core_api.list_namespaced_endpoints,
+        namespace,
+        field_selector=f"metadata.name={name}",
+        timeout_seconds=timeout,
+    ):
+        if event["type"] != "DELETED" and _has_ready_addresses(event["object"]):
+            watch.stop()
+            logger.info(f"Service {name} in Namespace {namespace} is ready")
+            return True
+    logger.warning(
+        f"Timed out waiting for endpoints of Service {name} in Namespace {namespace}"
+    )
+    return False
+
+
+def wait_for_webhooks(
+    error: WebhookNotReadyError,
+    *,
+    api_client: kubernetes.client.ApiClient,
+    timeout: int,
+    logger: logging.Logger,
+) -> None:
+    """
+    Wait for the Services backing the webhooks named in the given error to
+    have ready endpoints, and record on the error whether that wait succeeded.
+    """
+    services = error.services or _webhook_services(
+        error.webhooks,
+        admission_api=kubernetes.client.AdmissionregistrationV1Api(api_client),
+    )
+    if not services:
+        logger.warning(f"Could not find the Services backing webhooks {error.webhooks}")
+        return
+    core_api = kubernetes.client.CoreV1Api(api_client)
+    waited = [
+        _wait_for_endpoints(s, core_api=core_api, timeout=timeout, logger=logger)
+        for s in sorted(services)
+    ]
+    error.waited = any(waited)
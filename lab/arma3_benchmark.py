@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the Arma 3 mod update pipeline.
+
+update_arma3_mods() normally needs running Arma 3 Pods and a Steam account.
+This harness runs it against a fake exec backend instead, which simulates
+steamcmd: each download takes a configurable time, and may be cut short by a
+segfault or a timeout, or refused with Rate Limit Exceeded. Like the real
+steamcmd, an interrupted download resumes where it left off on the next
+attempt. Other commands, such as linking mods, succeed after a short delay.
+
+Simulated time is scaled down so that a benchmark of a large modset, including
+the five minute backoffs after rate limiting, runs in seconds. All sleeps in
+the process are scaled, so retry waits are simulated faithfully. Note the
+time spent running the pipeline itself is scaled up too, so the time scale
+should not be so small that it dominates. The harness reports the simulated
+wall-clock time, the number of steamcmd calls and how many of them were
+retries.
+"""
+import argparse
+import dataclasses
+import logging
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from unittest import mock
+
+import kubernetes.client  # type: ignore
+
+import main as lab
+from config import Arma3Mod
+
+_DOWNLOAD = re.compile(r"\+workshop_download_item \S+ (?P<workshop_id>\d+)")
+_real_sleep = time.sleep
+
+
+@dataclasses.dataclass
+class SteamBehaviour:  # pylint: disable=too-many-instance-attributes
+    # latency is the mean simulated seconds to download a mod.
+    latency: float = 30.0
+    # jitter is the fraction by which each mod's latency varies from the mean.
+    jitter: float = 0.5
+    # segfault_rate is the probability of steamcmd segfaulting mid-download.
+    segfault_rate: float = 0.05
+    # timeout_rate is the probability of steamcmd timing out mid-download.
+    timeout_rate: float = 0.05
+    # rate_limit_rate is the probability of any call being rate limited.
+    rate_limit_rate: float = 0.0
+    # rate_limit_calls is the number of calls allowed per rate_limit_window
+    # before calls are rate limited, or None for no limit.
+    rate_limit_calls: Optional[int] = None
+    rate_limit_window: float = 60.0
+    # exec_latency is the simulated seconds taken by other commands.
+    exec_latency: float = 0.5
+
+
+@dataclasses.dataclass
+class SteamStatistics:
+    # seconds is the simulated wall-clock time taken.
+    seconds: float = 0.0
+    calls: int = 0
+    downloads: int = 0
+    segfaults: int = 0
+    timeouts: int = 0
+    rate_limits: int = 0
+    execs: int = 0
+
+    @property
+    def retries(self) -> int:
+        return self.calls - self.downloads
+
+
+class FakeSteam:  # pylint: disable=too-many-instance-attributes
+    """
+    A fake exec backend with the same signature as kubectl_exec, which
+    simulates steamcmd and records statistics about the calls to it.
+    """
+
+    def __init__(
+        self, behaviour: SteamBehaviour, *, time_scale: float, seed: int
+    ) -> None:
+        self.behaviour = behaviour
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+        self.statistics = SteamStatistics()
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        # latencies is the total download time of each mod.
+        self.latencies: Dict[str, float] = {}
+        # progress is the fraction of each mod downloaded to each Pod.
+        self.progress: Dict[Tuple[str, str], float] = {}
+        self.calls: List[float] = []
+
+    def now(self) -> float:
+        """
+        Return the simulated seconds since the simulation started.
+        """
+        return (time.monotonic() - self.started) / self.time_scale
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Sleep for the given number of simulated seconds.
+        """
+        _real_sleep(seconds * self.time_scale)
+
+    def _is_rate_limited(self) -> bool:
+        behaviour = self.behaviour
+        now = self.now()
+        self.calls = [t for t in self.calls if now - t < behaviour.rate_limit_window]
+        self.calls.append(now)
+        if (
+            behaviour.rate_limit_calls is not None
+            and len(self.calls) > behaviour.rate_limit_calls
+        ):
+            return True
+        return self.random.random() < behaviour.rate_limit_rate
+
+    def _download(self, pod: str, workshop_id: str) -> str:
+        behaviour = self.behaviour
+        with self.lock:
+            self.statistics.calls += 1
+            if self._is_rate_limited():
+                self.statistics.rate_limits += 1
+                outcome = "rate_limit"
+            else:
+                roll = self.random.random()
+                if roll < behaviour.segfault_rate:
+                    outcome = "segfault"
+                elif roll < behaviour.segfault_rate + behaviour.timeout_rate:
+                    outcome = "timeout"
+                else:
+                    outcome = "success"
+            latency = self.latencies.setdefault(
+                workshop_id,
+                behaviour.latency
+                * self.random.uniform(1 - behaviour.jitter, 1 + behaviour.jitter),
+            )
+            progress = self.progress.get((pod, workshop_id), 0.0)
+            cut_short = self.random.uniform(progress, 1.0)
+
+        if outcome == "rate_limit":
+            self.sleep(behaviour.exec_latency)
+            return f"Downloading item {workshop_id} ...\nERROR! Download item {workshop_id} failed (Rate Limit Exceeded).\nFAILED (Rate Limit Exceeded)\n"
+
+        if outcome == "success":
+            self.sleep(latency * (1 - progress))
+            with self.lock:
+                self.statistics.downloads += 1
+                self.progress[(pod, workshop_id)] = 1.0
+            return f'Downloading item {workshop_id} ...\nSuccess. Downloaded item {workshop_id} to "/opt/arma3/steamapps/workshop/content/107410/{workshop_id}"\n'
+
+        # The download is interrupted part way, and will resume from there
+        self.sleep(latency * (cut_short - progress))
+        with self.lock:
+            self.progress[(pod, workshop_id)] = cut_short
+        if outcome == "timeout":
+            with self.lock:
+                self.statistics.timeouts += 1
+            return f"Downloading item {workshop_id} ...\nERROR! Timeout downloading item {workshop_id}\n"
+        with self.lock:
+            self.statistics.segfaults += 1
+        # kubectl_exec raises when the command exits unsuccessfully
+        raise RuntimeError(
+            f"Downloading item {workshop_id} ...\nSegmentation fault (core dumped)\n"
+        )
+
+    def __call__(
+        self,
+        *,
+        core_api: kubernetes.client.CoreV1Api,
+        pod: kubernetes.client.models.V1Pod,
+        container_name: str,
+        command: List[str],
+        logger: logging.Logger,
+    ) -> str:
+        logger.debug(
+            f"Running command `{' '.join(command)}` in Pod {pod.metadata.name} in Namespace {pod.metadata.namespace}"
+        )
+        match = _DOWNLOAD.search(command[-1])
+        if match:
+            return self._download(pod.metadata.name, match.group("workshop_id"))
+        with self.lock:
+            self.statistics.execs += 1
+        self.sleep(self.behaviour.exec_latency)
+        return ""
+
+
+def _fake_core_api(*, headless_clients: int) -> mock.Mock:
+    def pod(name: str) -> kubernetes.client.V1Pod:
+        return kubernetes.client.V1Pod(
+            metadata=kubernetes.client.V1ObjectMeta(name=name, namespace="arma3")
+        )
+
+    def list_namespaced_pod(*, label_selector: str, **_: str) -> mock.Mock:
+        if label_selector.endswith("=server"):
+            return mock.Mock(items=[pod("arma3-0")])
+        return mock.Mock(
+            items=[pod(f"arma3-headless-client-{i}") for i in range(headless_clients)]
+        )
+
+    core_api = mock.Mock(spec=kubernetes.client.CoreV1Api)
+    core_api.list_namespaced_pod.side_effect = list_namespaced_pod
+    return core_api
+
+
+def benchmark(
+    *,
+    mods: int,
+    headless_clients: int,
+    behaviour: SteamBehaviour,
+    time_scale: float,
+    seed: int,
+    logger: logging.Logger,
+    pipeline_logger: logging.Logger,
+) -> SteamStatistics:
+    # pylint: disable=too-many-arguments
+    """
+    Run update_arma3_mods() against a simulated steamcmd and report how long
+    it took in simulated time.
+    """
+    steam = FakeSteam(behaviour, time_scale=time_scale, seed=seed)
+    modset = [Arma3Mod(name=f"mod_{i}", workshop_id=450814997 + i) for i in range(mods)]
+    with mock.patch.object(lab, "kubectl_exec", steam), mock.patch.object(
+        time, "sleep", steam.sleep
+    ):
+        lab.update_arma3_mods(
+            mods=modset,
+            core_api=_fake_core_api(headless_clients=headless_clients),
+            logger=pipeline_logger,
+        )
+    statistics = steam.statistics
+    statistics.seconds = steam.now()
+    logger.info(
+        f"Updated {mods} mod(s) on {1 + headless_clients} Pod(s) in {statistics.seconds:.1f}s of simulated time ({statistics.seconds * time_scale:.1f}s real)"
+    )
+    logger.info(
+        f"steamcmd calls: {statistics.calls} ({statistics.retries} retries: {statistics.segfaults} segfaults, {statistics.timeouts} timeouts, {statistics.rate_limits} rate limited); other execs: {statistics.execs}"
+    )
+    return statistics
+
+
+def main() -> None:
+    """
+    Benchmark the Arma 3 mod update pipeline with a simulated steamcmd
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark updating Arma 3 mods against a simulated steamcmd"
+    )
+    parser.add_argument(
+        "--mods", type=int, default=50, metavar="N", help="Number of mods to update"
+    )
+    parser.add_argument(
+        "--headless-clients",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of headless client Pods",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=SteamBehaviour.latency,
+        metavar="SECONDS",
+        help="Mean time to download a mod",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=SteamBehaviour.jitter,
+        metavar="FRACTION",
+        help="Fraction by which each mod's download time varies from the mean",
+    )
+    parser.add_argument(
+        "--segfault-rate",
+        type=float,
+        default=SteamBehaviour.segfault_rate,
+        metavar="P",
+        help="Probability of steamcmd segfaulting during a download",
+    )
+    parser.add_argument(
+        "--timeout-rate",
+        type=float,
+        default=SteamBehaviour.timeout_rate,
+        metavar="P",
+        help="Probability of steamcmd timing out during a download",
+    )
+    parser.add_argument(
+        "--rate-limit-rate",
+        type=float,
+        default=SteamBehaviour.rate_limit_rate,
+        metavar="P",
+        help="Probability of any steamcmd call being rate limited",
+    )
+    parser.add_argument(
+        "--rate-limit-calls",
+        type=int,
+        metavar="N",
+        help="Rate limit steamcmd calls beyond this many per rate limit window",
+    )
+    parser.add_argument(
+        "--rate-limit-window",
+        type=float,
+        default=SteamBehaviour.rate_limit_window,
+        metavar="SECONDS",
+        help="Window over which --rate-limit-calls is counted",
+    )
+    parser.add_argument(
+        "--exec-latency",
+        type=float,
+        default=SteamBehaviour.exec_latency,
+        metavar="SECONDS",
+        help="Time taken by commands other than steamcmd",
+    )
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=0.001,
+        metavar="FACTOR",
+        help="Real seconds per simulated second",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed for the simulation's randomness"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Log the pipeline's progress"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s"
+    )
+    # The pipeline logs every simulated failure, which is only useful when
+    # debugging the simulation
+    pipeline_logger = logging.getLogger("pipeline")
+    if not args.verbose:
+        pipeline_logger.setLevel(logging.CRITICAL)
+    benchmark(
+        mods=args.mods,
+        headless_clients=args.headless_clients,
+        behaviour=SteamBehaviour(
+            latency=args.latency,
+            jitter=args.jitter,
+            segfault_rate=args.segfault_rate,
+            timeout_rate=args.timeout_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            rate_limit_calls=args.rate_limit_calls,
+            rate_limit_window=args.rate_limit_window,
+            exec_latency=args.exec_latency,
+        ),
+        time_scale=args.time_scale,
+        seed=args.seed,
+        logger=logging.getLogger(__name__),
+        pipeline_logger=pipeline_logger,
+    )
+
+
+if __name__ == "__main__":
+    main()
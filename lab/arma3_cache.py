@@ -0,0 +1,368 @@
+"""
+Host-side cache of Arma 3 workshop content.
+
+Downloading a large modset from Steam takes hours, mostly spent being rate
+limited, so rebuilding the lab would otherwise mean downloading it all again.
+Instead, the workshop content in a Pod's volume can be exported to a cache on
+the host and imported into the volumes of a fresh cluster at local disk speed.
+
+Each mod is cached as a gzipped tarball alongside a JSON file recording its
+SHA-256 checksum and a fingerprint of the file listing it was built from.
+Data is streamed over exec as base64, since exec channels are text:
+
+- Exports stream the tarball straight out of the Pod into a .part file. If an
+  export is interrupted, it resumes from the end of the .part file, which
+  relies on the tarball being reproducible while the mod is unchanged.
+- Imports upload the tarball into a staging file in the Pod's volume in
+  chunks, each chunk a separate exec, so an interrupted import resumes from
+  the last complete chunk. The staged tarball is verified against the
+  checksum before it replaces the mod's content.
+"""
+import base64
+import hashlib
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import kubernetes.client  # type: ignore
+import kubernetes.stream  # type: ignore
+import yaml
+
+from config import Arma3Mod
+
+WORKSHOP_DIRECTORY = "/opt/arma3/steamapps/workshop"
+CONTENT_DIRECTORY = f"{WORKSHOP_DIRECTORY}/content/$ARMA3_APPID"
+STAGING_DIRECTORY = f"{WORKSHOP_DIRECTORY}/.import"
+# Records the checksum of the tarball each mod was last imported from
+IMPORTED_DIRECTORY = f"{WORKSHOP_DIRECTORY}/.imported"
+# Steam's record of which workshop items are installed. Without it, Steam
+# would download every imported mod again.
+ACF_PATH = f"{WORKSHOP_DIRECTORY}/appworkshop_$ARMA3_APPID.acf"
+
+CONTAINER_NAME = "steamcmd"
+# Size of each websocket message written to an exec's stdin
+_STDIN_MESSAGE_SIZE = 1024 * 1024
+_PROGRESS_INTERVAL = 256 * 1024 * 1024
+
+
+def _exec(
+    script: str,
+    *,
+    pod: kubernetes.client.models.V1Pod,
+    core_api: kubernetes.client.CoreV1Api,
+    stdin: Optional[bytes] = None,
+    on_stdout: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    Run a bash script in the steamcmd container of the given Pod, optionally
+    streaming data to its stdin and from its stdout.
+
+    :return: The script's stdout if on_stdout was not given, otherwise its
+    stderr.
+    """
+    client = kubernetes.stream.stream(
+        core_api.connect_get_namespaced_pod_exec,
+        name=pod.metadata.name,
+        namespace=pod.metadata.namespace,
+        container=CONTAINER_NAME,
+        command=["bash", "-c", f"set -euo pipefail\n{script}"],
+        stdin=stdin is not None,
+        stdout=True,
+        stderr=True,
+        tty=False,
+        _preload_content=False,
+    )
+    if stdin is not None:
+        for offset in range(0, len(stdin), _STDIN_MESSAGE_SIZE):
+            client.write_stdin(stdin[offset : offset + _STDIN_MESSAGE_SIZE].decode())
+    stdout: List[str] = []
+    stderr: List[str] = []
+    while client.is_open():
+        client.update(timeout=1)
+        if client.peek_stdout():
+            output = client.read_stdout()
+            if on_stdout is None:
+                stdout.append(output)
+            else:
+                on_stdout(output)
+        if client.peek_stderr():
+            stderr.append(client.read_stderr())
+    error = yaml.safe_load(
+        client.read_channel(kubernetes.stream.ws_client.ERROR_CHANNEL) or "{}"
+    )
+    if error and error.get("status") != "Success":
+        raise RuntimeError(
+            f"Command failed in Pod {pod.metadata.name}: {error.get('message')}\n{''.join(stderr)}"
+        )
+    return "".join(stderr if on_stdout is not None else stdout)
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fingerprint(
+    mod: Arma3Mod,
+    *,
+    pod: kubernetes.client.models.V1Pod,
+    core_api: kubernetes.client.CoreV1Api,
+) -> Optional[str]:
+    """
+    Return a fingerprint of the names, sizes and modification times of a
+    mod's files in the Pod's volume, which is cheap to compute, or None if
+    the mod has not been downloaded.
+    """
+    fingerprint = _exec(
+        f"cd {CONTENT_DIRECTORY}\n"
+        f"if [ -d {mod.workshop_id} ]; then\n"
+        f"  find {mod.workshop_id} -printf '%P %s %T@\\n' | LC_ALL=C sort | sha256sum | cut -d' ' -f1\n"
+        "fi",
+        pod=pod,
+        core_api=core_api,
+    ).strip()
+    return fingerprint or None
+
+
+class _Base64Writer:
+    """
+    Decodes a base64 stream which may be split at arbitrary points and
+    appends it to a file.
+    """
+
+    def __init__(self, path: Path, *, logger: logging.Logger) -> None:
+        self.file = open(path, "ab")  # pylint: disable=consider-using-with
+        self.logger = logger
+        self.path = path
+        self.remainder = ""
+        self.written = self.file.tell()
+        self.next_progress = self.written + _PROGRESS_INTERVAL
+
+    def write(self, text: str) -> None:
+        text = self.remainder + "".join(text.split())
+        usable = len(text) - len(text) % 4
+        self.remainder = text[usable:]
+        self.written += self.file.write(base64.b64decode(text[:usable]))
+        if self.written >= self.next_progress:
+            self.logger.info(
+                f"Received {self.written // (1024 * 1024)} MiB of {self.path.name}..."
+            )
+            self.next_progress += _PROGRESS_INTERVAL
+
+    def close(self) -> None:
+        # A complete stream is padded to a whole number of groups, so a
+        # remainder means the stream was interrupted. Its partial group is
+        # dropped, since a resumed export restarts from the file's size.
+        try:
+            if self.remainder:
+                self.logger.debug(
+                    f"Dropping {len(self.remainder)} trailing base64 character(s) of {self.path.name}"
+                )
+                self.remainder = ""
+        finally:
+            self.file.close()
+
+
+def export_arma3_mods(
+    *,
+    mods: List[Arma3Mod],
+    pod: kubernetes.client.models.V1Pod,
+    core_api: kubernetes.client.CoreV1Api,
+    cache_directory: Path,
+    logger: logging.Logger,
+) -> None:
+    # pylint: disable=too-many-locals
+    """
+    Export the given mods' workshop content from the given Pod's volume to
+    the cache directory. Mods which have not been downloaded are skipped.
+    """
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Exporting Steam workshop manifest from Pod {pod.metadata.name}...")
+    acf = _exec(f"cat {ACF_PATH} 2>/dev/null || true", pod=pod, core_api=core_api)
+    if acf:
+        (cache_directory / "appworkshop.acf").write_text(acf, encoding="utf-8")
+
+    for mod in mods:
+        archive = cache_directory / f"{mod.workshop_id}.tar.gz"
+        metadata_path = cache_directory / f"{mod.workshop_id}.json"
+        part = cache_directory / f"{mod.workshop_id}.tar.gz.part"
+        part_metadata_path = cache_directory / f"{mod.workshop_id}.part.json"
+
+        fingerprint = _fingerprint(mod, pod=pod, core_api=core_api)
+        if fingerprint is None:
+            logger.warning(
+                f"{mod.name} ({mod.workshop_id}) is not downloaded in Pod {pod.metadata.name}"
+            )
+            continue
+        if (
+            archive.is_file()
+            and metadata_path.is_file()
+            and json.loads(metadata_path.read_text())["fingerprint"] == fingerprint
+        ):
+            logger.info(f"{mod.name} ({mod.workshop_id}) cache is up to date")
+            continue
+
+        if (
+            not part_metadata_path.is_file()
+            or json.loads(part_metadata_path.read_text())["fingerprint"] != fingerprint
+        ):
+            # Content changed since the partial export, so start again
+            part.unlink(missing_ok=True)
+            part_metadata_path.write_text(json.dumps({"fingerprint": fingerprint}))
+        offset = part.stat().st_size if part.is_file() else 0
+        if offset:
+            logger.info(
+                f"Resuming export of {mod.name} ({mod.workshop_id}) from {offset} bytes..."
+            )
+        else:
+            logger.info(f"Exporting {mod.name} ({mod.workshop_id})...")
+
+        writer = _Base64Writer(part, logger=logger)
+        try:
+            # The complete tarball is checksummed in the Pod, even when
+            # resuming, and the checksum reported on stderr
+            stderr = _exec(
+                "\n".join(
+                    [
+                        f"cd {CONTENT_DIRECTORY}",
+                        "fifo=$(mktemp -u)",
+                        'mkfifo "$fifo"',
+                        "sha256sum < \"$fifo\" | cut -d' ' -f1 >&2 &",
+                        f'tar --sort=name --numeric-owner -cf - {mod.workshop_id} | gzip -n | tee "$fifo" | tail -c +{offset + 1} | base64 -w 0',
+                        "wait $!",
+                        'rm -f "$fifo"',
+                    ]
+                ),
+                pod=pod,
+                core_api=core_api,
+                on_stdout=writer.write,
+            )
+        finally:
+            writer.close()
+
+        checksums = re.findall(r"\b[0-9a-f]{64}\b", stderr)
+        checksum = _sha256(part)
+        if not checksums or checksums[-1] != checksum:
+            part.unlink()
+            raise RuntimeError(
+                f"Checksum mismatch exporting {mod.name} ({mod.workshop_id}). The partial export has been discarded; run the export again."
+            )
+        part.replace(archive)
+        metadata_path.write_text(
+            json.dumps({"fingerprint": fingerprint, "sha256": checksum})
+        )
+        part_metadata_path.unlink()
+        logger.info(
+            f"Exported {mod.name} ({mod.workshop_id}): {archive.stat().st_size // (1024 * 1024)} MiB, sha256 {checksum}"
+        )
+
+
+def import_arma3_mods(
+    *,
+    mods: List[Arma3Mod],
+    pod: kubernetes.client.models.V1Pod,
+    core_api: kubernetes.client.CoreV1Api,
+    cache_directory: Path,
+    chunk_size: int,
+    logger: logging.Logger,
+) -> None:
+    # pylint: disable=too-many-arguments,too-many-locals
+    """
+    Import the given mods' workshop content from the cache directory into
+    the given Pod's volume. Mods which are not in the cache are skipped.
+    """
+    acf = cache_directory / "appworkshop.acf"
+    if acf.is_file():
+        data = acf.read_bytes()
+        _exec(
+            f"test -e {ACF_PATH} || head -c {len(data)} > {ACF_PATH}",
+            pod=pod,
+            core_api=core_api,
+            stdin=data,
+        )
+
+    for mod in mods:
+        archive = cache_directory / f"{mod.workshop_id}.tar.gz"
+        metadata_path = cache_directory / f"{mod.workshop_id}.json"
+        if not archive.is_file() or not metadata_path.is_file():
+            logger.warning(f"{mod.name} ({mod.workshop_id}) is not in the cache")
+            continue
+        checksum = json.loads(metadata_path.read_text())["sha256"]
+        staging = f"{STAGING_DIRECTORY}/{mod.workshop_id}.tar.gz"
+
+        imported = _exec(
+            f"cat {IMPORTED_DIRECTORY}/{mod.workshop_id} 2>/dev/null || true",
+            pod=pod,
+            core_api=core_api,
+        ).strip()
+        if imported == checksum:
+            logger.info(
+                f"{mod.name} ({mod.workshop_id}) in volume for Pod {pod.metadata.name} is up to date"
+            )
+            continue
+
+        size = archive.stat().st_size
+        offset = int(
+            _exec(
+                f"mkdir -p {STAGING_DIRECTORY}\nstat -c %s {staging} 2>/dev/null || echo 0",
+                pod=pod,
+                core_api=core_api,
+            ).strip()
+        )
+        if offset > size:
+            offset = 0
+            _exec(f"rm -f {staging}", pod=pod, core_api=core_api)
+        if offset:
+            logger.info(
+                f"Resuming import of {mod.name} ({mod.workshop_id}) into Pod {pod.metadata.name} from {offset} bytes..."
+            )
+        else:
+            logger.info(
+                f"Importing {mod.name} ({mod.workshop_id}) into Pod {pod.metadata.name}..."
+            )
+
+        with open(archive, "rb") as f:
+            f.seek(offset)
+            while chunk := f.read(chunk_size):
+                encoded = base64.b64encode(chunk)
+                _exec(
+                    f"head -c {len(encoded)} | base64 -d >> {staging}",
+                    pod=pod,
+                    core_api=core_api,
+                    stdin=encoded,
+                )
+                offset += len(chunk)
+                logger.info(
+                    f"Uploaded {offset // (1024 * 1024)} of {size // (1024 * 1024)} MiB of {mod.name} ({mod.workshop_id})"
+                )
+
+        logger.info(f"Verifying and extracting {mod.name} ({mod.workshop_id})...")
+        extract_directory = f"{STAGING_DIRECTORY}/{mod.workshop_id}"
+        _exec(
+            "\n".join(
+                [
+                    f"if [ \"$(sha256sum < {staging} | cut -d' ' -f1)\" != {checksum} ]; then",
+                    f"  rm -f {staging}",
+                    '  echo "Checksum mismatch, discarded staged upload" >&2',
+                    "  exit 1",
+                    "fi",
+                    f"rm -rf {extract_directory}",
+                    f"mkdir -p {extract_directory} {CONTENT_DIRECTORY} {IMPORTED_DIRECTORY}",
+                    f"tar -xzf {staging} -C {extract_directory}",
+                    f"rm -rf {CONTENT_DIRECTORY}/{mod.workshop_id}",
+                    f"mv {extract_directory}/{mod.workshop_id} {CONTENT_DIRECTORY}/{mod.workshop_id}",
+                    f"rm -rf {extract_directory} {staging}",
+                    f"echo {checksum} > {IMPORTED_DIRECTORY}/{mod.workshop_id}",
+                ]
+            ),
+            pod=pod,
+            core_api=core_api,
+        )
+        logger.info(
+            f"Imported {mod.name} ({mod.workshop_id}) into volume for Pod {pod.metadata.name}"
+        )
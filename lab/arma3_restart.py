@@ -0,0 +1,137 @@
+"""
+Orchestrated restarts of the Arma 3 server and headless clients.
+
+The Arma 3 StatefulSets use the OnDelete update strategy, so changes to
+their Pod templates (such as the mods to load) only take effect when their
+Pods are deleted. Deleting every Pod at once would leave the headless clients
+trying to connect to a server which is still starting. Instead, the server
+is restarted first, and the headless clients are only restarted once the
+server is Ready. Pod readiness is detected with watches rather than polling.
+"""
+import logging
+import time
+from typing import Set
+
+import kubernetes.client  # type: ignore
+import kubernetes.watch  # type: ignore
+
+NAMESPACE = "arma3"
+
+
+def _is_ready(pod: kubernetes.client.V1Pod) -> bool:
+    if pod.metadata.deletion_timestamp is not None:
+        return False
+    return any(
+        c.type == "Ready" and c.status == "True" for c in pod.status.conditions or []
+    )
+
+
+def _wait_for_replacements(
+    component: str,
+    *,
+    replaced: Set[str],
+    replicas: int,
+    core_api: kubernetes.client.CoreV1Api,
+    timeout: int,
+) -> None:
+    """
+    Wait for the given number of Pods of the given component, other than the
+    Pods being replaced, to be Ready.
+    """
+    ready: Set[str] = set()
+    deadline = time.monotonic() + timeout
+    watch = kubernetes.watch.Watch()
+    # The apiserver may end a watch early, in which case start another
+    while time.monotonic() < deadline:
+        for event in watch.stream(
+            core_api.list_namespaced_pod,
+            NAMESPACE,
+            label_selector=f"app.kubernetes.io/name=arma3,app.kubernetes.io/component={component}",
+            timeout_seconds=max(1, int(deadline - time.monotonic())),
+        ):
+            pod = event["object"]
+            if pod.metadata.uid in replaced:
+                continue
+            if event["type"] != "DELETED" and _is_ready(pod):
+                ready.add(pod.metadata.uid)
+            else:
+                ready.discard(pod.metadata.uid)
+            if len(ready) >= replicas:
+                watch.stop()
+                return
+    raise TimeoutError(f"Timed out waiting for Arma 3 {component} Pods to be Ready")
+
+
+def _restart(
+    component: str,
+    *,
+    statefulset: str,
+    apps_api: kubernetes.client.AppsV1Api,
+    core_api: kubernetes.client.CoreV1Api,
+    timeout: int,
+    logger: logging.Logger,
+) -> float:
+    # pylint: disable=too-many-arguments
+    """
+    Delete the Pods of the given component and wait for their replacements
+    to be Ready.
+
+    :return: The number of seconds the component was unavailable.
+    """
+    replicas = apps_api.read_namespaced_stateful_set(
+        statefulset, NAMESPACE
+    ).spec.replicas
+    pods = core_api.list_namespaced_pod(
+        NAMESPACE,
+        label_selector=f"app.kubernetes.io/name=arma3,app.kubernetes.io/component={component}",
+    ).items
+    started = time.monotonic()
+    for pod in pods:
+        logger.info(f"Deleting Pod {pod.metadata.name} in Namespace {NAMESPACE}...")
+        core_api.delete_namespaced_pod(pod.metadata.name, NAMESPACE)
+    logger.info(f"Waiting for {replicas} Arma 3 {component} Pod(s) to be Ready...")
+    _wait_for_replacements(
+        component,
+        replaced={pod.metadata.uid for pod in pods},
+        replicas=replicas,
+        core_api=core_api,
+        timeout=timeout,
+    )
+    return time.monotonic() - started
+
+
+def restart_arma3(
+    *,
+    api_client: kubernetes.client.ApiClient,
+    timeout: int,
+    logger: logging.Logger,
+) -> None:
+    """
+    Restart the Arma 3 server, then the headless clients once the server is
+    Ready, and report how long each was unavailable.
+    """
+    apps_api = kubernetes.client.AppsV1Api(api_client)
+    core_api = kubernetes.client.CoreV1Api(api_client)
+    server_downtime = _restart(
+        "server",
+        statefulset="arma3",
+        apps_api=apps_api,
+        core_api=core_api,
+        timeout=timeout,
+        logger=logger,
+    )
+    logger.info(f"Arma 3 server is Ready after {server_downtime:.1f}s of downtime")
+    client_downtime = _restart(
+        "headless-client",
+        statefulset="arma3-headless-client",
+        apps_api=apps_api,
+        core_api=core_api,
+        timeout=timeout,
+        logger=logger,
+    )
+    logger.info(
+        f"Arma 3 headless clients are Ready after {client_downtime:.1f}s of downtime"
+    )
+    logger.info(
+        f"Restarted Arma 3 in {server_downtime + client_downtime:.1f}s. The server was unavailable for {server_downtime:.1f}s."
+    )
@@ -26,7 +26,7 @@ and set the LABCONFIG environment variable to the JSON file's path.
 # pylint: disable=no-self-argument,no-self-use
 import enum
 import string
-from typing import Any, List
+from typing import Any, List, Optional
 
 import pydantic
 
@@ -36,7 +36,7 @@ class ExtendedBaseModel(pydantic.BaseModel):
         def plaintext_encoder(obj: Any) -> Any:
             if isinstance(obj, (pydantic.SecretStr, pydantic.SecretBytes)):
                 return obj.get_secret_value()
-            return pydantic.json.pydantic_encoder  # pylint: disable=no-member
+            return pydantic.json.pydantic_encoder(obj)  # pylint: disable=no-member
 
         return self.json(*args, encoder=plaintext_encoder, **kwargs)
 
@@ -132,8 +132,41 @@ class Arma3(ExtendedBaseModel):
         return v
 
 
+class Resources(ExtendedBaseModel):
+    # enabled sets the requests and limits of workload containers from their
+    # historical p95 CPU and memory usage. Containers without usage data are
+    # left as they are.
+    enabled: bool = False
+    # prometheus_url is the Prometheus to query for usage. Defaults to the
+    # bundled Prometheus at nginx.base_url + "/prometheus".
+    prometheus_url: Optional[pydantic.AnyHttpUrl] = None
+    # usage_file is a JSON file of recorded usage to use instead of querying
+    # Prometheus. See usage.py for the format.
+    usage_file: Optional[pydantic.FilePath] = None
+    # window is the period of usage history to consider, as a Prometheus
+    # duration.
+    window: str = "7d"
+    # cpu_headroom and memory_headroom are multiplied by p95 usage to give
+    # requests.
+    cpu_headroom: float = 1.25
+    memory_headroom: float = 1.25
+    # memory_limit_ratio is multiplied by the memory request to give the
+    # memory limit.
+    memory_limit_ratio: float = 1.5
+    # cpu_limit_ratio is multiplied by the CPU request to give the CPU limit.
+    # By default CPU limits are not set, since they throttle containers even
+    # when the node is idle.
+    cpu_limit_ratio: Optional[float] = None
+    # Requests and limits are clamped between these bounds.
+    min_cpu_millicores: int = 10
+    max_cpu_millicores: int = 4000
+    min_memory_mib: int = 32
+    max_memory_mib: int = 8192
+
+
 class LabConfig(ExtendedBaseModel):
     # Top level configuration object
     cert_manager: CertManager
     nginx: Nginx
     arma3: Arma3
+    resources: Resources = Resources()
@@ -0,0 +1,60 @@
+"""
+Builds Grafana dashboard ConfigMaps from raw dashboard JSON files.
+
+Dashboards are kept in the repository as the pretty-printed JSON exported by
+Grafana or vendored from upstream, in files named <name>.dashboard.json. Each
+file is turned into a ConfigMap named grafana-dashboard-<name> which the
+Grafana Deployment mounts into its dashboard provider directory.
+
+The JSON is minified on the way, roughly halving the size of each ConfigMap,
+and is never passed through Jinja or the YAML parser: dashboards are full of
+Grafana's own {{ }} legend templates, and parsing a large JSON document as
+YAML is much slower than parsing it as JSON.
+"""
+import json
+from pathlib import Path
+
+DASHBOARD_SUFFIX = ".dashboard.json"
+
+# Objects stored in etcd are limited to roughly 1 MiB. Leave headroom for
+# the ConfigMap's metadata and managedFields.
+MAX_DASHBOARD_BYTES = 768 * 1024
+
+NAMESPACE = "monitoring"
+
+LABELS = {
+    "app.kubernetes.io/component": "grafana",
+    "app.kubernetes.io/name": "grafana",
+    "app.kubernetes.io/part-of": "kube-prometheus",
+    "app.kubernetes.io/version": "8.2.2",
+}
+
+
+def is_dashboard(path: Path) -> bool:
+    return path.name.endswith(DASHBOARD_SUFFIX)
+
+
+def load_dashboard(path: Path) -> dict:
+    """
+    Build a ConfigMap containing the minified dashboard in the given file.
+    """
+    name = path.name[: -len(DASHBOARD_SUFFIX)]
+    with open(path, "r", encoding="utf-8") as f:
+        dashboard = json.dumps(json.load(f), separators=(",", ":"), ensure_ascii=False)
+    size = len(dashboard.encode("utf-8"))
+    if size > MAX_DASHBOARD_BYTES:
+        # A dashboard must be provisioned from a single file, so it cannot be
+        # split across multiple ConfigMaps
+        raise ValueError(
+            f"Dashboard {path} is {size} bytes after minification, which exceeds the {MAX_DASHBOARD_BYTES} byte ConfigMap budget"
+        )
+    return {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "metadata": {
+            "name": f"grafana-dashboard-{name}",
+            "namespace": NAMESPACE,
+            "labels": dict(LABELS),
+        },
+        "data": {f"{name}.json": dashboard},
+    }
@@ -0,0 +1,288 @@
+"""
+Persistent index of the Kubernetes objects defined by each manifest file.
+
+Parsing every manifest under deploy/ is expensive (several megabytes of YAML),
+so when only a subset of objects is being deployed we consult this index to
+find out which files need to be read. Each entry is keyed by the file's path
+and is considered fresh while the file's modification time and size are
+unchanged. Templated files also record a fingerprint of the LabConfig they
+were rendered with, since their output depends on it.
+"""
+import hashlib
+import logging
+import re
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import pydantic
+
+from config import LabConfig
+from dashboards import is_dashboard
+
+
+def object_key(manifest: dict) -> str:
+    """
+    Return a string which uniquely identifies the given object within a
+    cluster.
+    """
+    metadata = manifest["metadata"]
+    return "/".join(
+        (manifest["kind"], metadata.get("namespace") or "", metadata["name"])
+    )
+
+
+def is_templated(path: Path) -> bool:
+    """
+    Return True if the given manifest file may be a Jinja template.
+    """
+    if is_dashboard(path):
+        return False
+    raw_document = path.read_text(encoding="utf-8")
+    return "{{" in raw_document or "{%" in raw_document
+
+
+def config_fingerprint(config: LabConfig) -> str:
+    return hashlib.sha256(
+        config.json_with_plaintext_secrets(sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def walk_manifest_files(paths: Sequence[Path]) -> Iterator[Path]:
+    """
+    Yield the manifest files at or beneath the given paths.
+    """
+    for path in paths:
+        if path.is_dir():
+            yield from walk_manifest_files(sorted(path.iterdir()))
+        elif path.is_file():
+            yield path
+
+
+_LABEL_KEY = re.compile(
+    r"^([a-z0-9]([-a-z0-9.]*[a-z0-9])?/)?[A-Za-z0-9]([-A-Za-z0-9_.]*[A-Za-z0-9])?$"
+)
+_LABEL_VALUE = re.compile(r"^([A-Za-z0-9]([-A-Za-z0-9_.]*[A-Za-z0-9])?)?$")
+
+
+class LabelSelector:
+    """
+    An equality-based Kubernetes label selector, e.g.
+    "app.kubernetes.io/name=grafana,tier!=frontend,!legacy". Set-based
+    requirements such as "tier in (a,b)" are not supported.
+    """
+
+    def __init__(self, selector: str) -> None:
+        # Each requirement is an (operator, key, value) tuple
+        self.requirements: List[Tuple[str, str, Optional[str]]] = []
+        for requirement in (r.strip() for r in selector.split(",")):
+            if not requirement:
+                continue
+            if "!=" in requirement:
+                key, value = requirement.split("!=", 1)
+                self.requirements.append(("!=", key.strip(), value.strip()))
+            elif "=" in requirement:
+                key, value = requirement.replace("==", "=").split("=", 1)
+                self.requirements.append(("=", key.strip(), value.strip()))
+            elif requirement.startswith("!"):
+                self.requirements.append(("!", requirement[1:].strip(), None))
+            else:
+                self.requirements.append(("", requirement, None))
+            _, parsed_key, parsed_value = self.requirements[-1]
+            if not _LABEL_KEY.match(parsed_key) or not _LABEL_VALUE.match(
+                parsed_value or ""
+            ):
+                raise ValueError(
+                    f"Invalid or unsupported label selector requirement: {requirement}"
+                )
+
+    def matches(self, labels: Dict[str, str]) -> bool:
+        for operator, key, value in self.requirements:
+            if operator == "=" and labels.get(key) != value:
+                return False
+            if operator == "!=" and labels.get(key) == value:
+                return False
+            if operator == "!" and key in labels:
+                return False
+            if operator == "" and key not in labels:
+                return False
+        return True
+
+
+class ObjectRef(pydantic.BaseModel):
+    api_version: str
+    kind: str
+    name: str
+    namespace: Optional[str] = None
+    labels: Dict[str, str] = {}
+    # defines is set on CustomResourceDefinitions to the API group and kind
+    # of the custom resource they define, in the form "group/Kind".
+    defines: Optional[str] = None
+
+    @classmethod
+    def from_manifest(cls, manifest: dict) -> "ObjectRef":
+        metadata = manifest["metadata"]
+        defines = None
+        if manifest["kind"] == "CustomResourceDefinition":
+            spec = manifest["spec"]
+            defines = f"{spec['group']}/{spec['names']['kind']}"
+        return cls(
+            api_version=manifest["apiVersion"],
+            kind=manifest["kind"],
+            name=metadata["name"],
+            namespace=metadata.get("namespace"),
+            labels=metadata.get("labels") or {},
+            defines=defines,
+        )
+
+    @property
+    def key(self) -> str:
+        return "/".join((self.kind, self.namespace or "", self.name))
+
+    @property
+    def group(self) -> str:
+        return self.api_version.rpartition("/")[0]
+
+
+class FileEntry(pydantic.BaseModel):
+    mtime_ns: int
+    size: int
+    # config_fingerprint is the fingerprint of the LabConfig a templated file
+    # was rendered with, or None if the file is not templated.
+    config_fingerprint: Optional[str] = None
+    objects: List[ObjectRef] = []
+
+
+class Selector(pydantic.BaseModel):
+    namespaces: List[str] = []
+    kinds: List[str] = []
+    names: List[str] = []
+    labels: Optional[str] = None
+    _label_selector: Optional[LabelSelector] = pydantic.PrivateAttr(default=None)
+
+    def __init__(self, **data: Any) -> None:
+        super().__init__(**data)
+        if self.labels:
+            self._label_selector = LabelSelector(self.labels)
+
+    def is_empty(self) -> bool:
+        return not (self.namespaces or self.kinds or self.names or self.labels)
+
+    def matches(self, ref: ObjectRef) -> bool:
+        if self.namespaces and ref.namespace not in self.namespaces:
+            return False
+        if self.kinds and ref.kind not in self.kinds:
+            return False
+        if self.names and ref.name not in self.names:
+            return False
+        if self._label_selector and not self._label_selector.matches(ref.labels):
+            return False
+        return True
+
+
+class ManifestIndex(pydantic.BaseModel):
+    files: Dict[str, FileEntry] = {}
+
+    @classmethod
+    def load(cls, path: Path, *, logger: logging.Logger) -> "ManifestIndex":
+        if not path.is_file():
+            return cls()
+        try:
+            return cls.parse_file(path)
+        except (pydantic.ValidationError, ValueError):
+            logger.warning(f"Discarding unreadable manifest index {path}")
+            return cls()
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(".tmp")
+        temporary_path.write_text(self.json(), encoding="utf-8")
+        temporary_path.replace(path)
+
+    def refresh(
+        self,
+        paths: Sequence[Path],
+        *,
+        config: LabConfig,
+        load: Callable[[Path], List[dict]],
+        logger: logging.Logger,
+    ) -> None:
+        """
+        Re-index any files beneath the given paths which have changed since
+        they were last indexed.
+        """
+        fingerprint = config_fingerprint(config)
+        seen: Set[str] = set()
+        for path in walk_manifest_files(paths):
+            seen.add(str(path))
+            stat = path.stat()
+            entry = self.files.get(str(path))
+            if (
+                entry is not None
+                and entry.mtime_ns == stat.st_mtime_ns
+                and entry.size == stat.st_size
+                and entry.config_fingerprint in (None, fingerprint)
+            ):
+                continue
+            logger.info(f"Indexing manifest {path}...")
+            self.files[str(path)] = FileEntry(
+                mtime_ns=stat.st_mtime_ns,
+                size=stat.st_size,
+                config_fingerprint=fingerprint if is_templated(path) else None,
+                objects=[ObjectRef.from_manifest(m) for m in load(path)],
+            )
+        for path in [Path(p) for p in self.files if p not in seen]:
+            if any(p == path or p in path.parents for p in paths):
+                del self.files[str(path)]
+
+    def select(self, selector: Selector, paths: Sequence[Path]) -> Dict[Path, Set[str]]:
+        """
+        Find the objects beneath the given paths matching the given selector,
+        along with their dependencies: the Namespace each object is in and the
+        CustomResourceDefinition of each custom resource.
+
+        :return: Mapping of file paths to the keys of the objects to load
+        from each file.
+        """
+        namespaces: Dict[str, ObjectRef] = {}
+        crds: Dict[str, ObjectRef] = {}
+        origins: Dict[str, Path] = {}
+        # The index may also cover files beneath other paths
+        files = {
+            Path(path): entry
+            for path, entry in self.files.items()
+            if any(p == Path(path) or p in Path(path).parents for p in paths)
+        }
+        for path, entry in files.items():
+            for ref in entry.objects:
+                origins[ref.key] = path
+                if ref.kind == "Namespace":
+                    namespaces[ref.name] = ref
+                if ref.defines:
+                    crds[ref.defines] = ref
+
+        selected: Dict[Path, Set[str]] = {}
+
+        def add(ref: ObjectRef) -> None:
+            selected.setdefault(origins[ref.key], set()).add(ref.key)
+
+        for entry in files.values():
+            for ref in entry.objects:
+                if not selector.matches(ref):
+                    continue
+                add(ref)
+                if ref.namespace in namespaces:
+                    add(namespaces[ref.namespace])
+                crd = crds.get(f"{ref.group}/{ref.kind}")
+                if crd is not None:
+                    add(crd)
+        return selected
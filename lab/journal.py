@@ -0,0 +1,122 @@
+"""
+Checkpoint journal of a deploy's progress, so an interrupted deploy can be
+resumed.
+
+A deploy applies its objects in phases (see deploy_manifests). As each phase
+completes, it is recorded in a per-target journal along with the keys of the
+objects it applied. A deploy run with --resume skips the phases and objects
+recorded by an earlier, interrupted deploy and continues from the first
+incomplete phase. The journal is removed when a deploy completes, so only an
+interrupted deploy can be resumed.
+
+Each journal is keyed by a fingerprint of the deploy's inputs: the contents
+of the manifest files, the LabConfig and the objects selected. A change to
+any of them invalidates the journal and the deploy starts over. The rendered
+manifests are not fingerprinted, since the usage pass sets resources from
+live Prometheus data, which changes from one run to the next.
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import List, Optional, Sequence, Set
+
+import pydantic
+
+from config import LabConfig
+from index import config_fingerprint, object_key, walk_manifest_files
+
+
+def deploy_fingerprint(
+    paths: Sequence[Path], *, config: LabConfig, manifests: List[dict]
+) -> str:
+    """
+    Return a fingerprint of the manifest files at or beneath the given paths,
+    the given LabConfig and the keys of the given manifests.
+    """
+    digest = hashlib.sha256(config_fingerprint(config).encode("utf-8"))
+    for path in sorted(set(walk_manifest_files(paths))):
+        digest.update(f"\0{path}\0".encode("utf-8"))
+        digest.update(path.read_bytes())
+    for key in sorted(object_key(m) for m in manifests):
+        digest.update(f"\0{key}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class DeployJournal(pydantic.BaseModel):
+    target: str
+    fingerprint: str
+    # phases is the names of the phases which have completed.
+    phases: List[str] = []
+    # objects is the keys of the objects applied by the completed phases.
+    objects: Set[str] = set()
+    # _path is None for a journal which is not saved.
+    _path: Optional[Path] = pydantic.PrivateAttr(default=None)
+
+    @classmethod
+    def start(
+        cls,
+        directory: Path,
+        *,
+        target: str,
+        fingerprint: str,
+        resume: bool,
+        logger: logging.Logger,
+    ) -> "DeployJournal":
+        """
+        Return the journal of an interrupted deploy to the given target with
+        the same fingerprint if resuming, otherwise a new journal.
+        """
+        name = hashlib.sha256(target.encode("utf-8")).hexdigest()[:16]
+        path = directory / f"{name}.json"
+        if resume and path.is_file():
+            try:
+                journal = cls(**json.loads(path.read_text(encoding="utf-8")))
+            except (pydantic.ValidationError, TypeError, ValueError):
+                logger.warning(f"Discarding unreadable deploy journal {path}")
+            else:
+                if journal.fingerprint == fingerprint:
+                    journal._path = path
+                    logger.info(
+                        f"Resuming deploy: {len(journal.phases)} phase(s) and {len(journal.objects)} object(s) already applied"
+                    )
+                    return journal
+                logger.info(
+                    "Manifests or lab config changed since the interrupted deploy, starting over"
+                )
+        elif resume:
+            logger.info("No interrupted deploy to resume, starting over")
+        journal = cls(target=target, fingerprint=fingerprint)
+        journal._path = path
+        journal.save()
+        return journal
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self._path.with_suffix(".tmp")
+        temporary_path.write_text(self.json(), encoding="utf-8")
+        temporary_path.replace(self._path)
+
+    def remove(self) -> None:
+        if self._path is not None:
+            self._path.unlink(missing_ok=True)
+
+    def is_complete(self, phase: str) -> bool:
+        return phase in self.phases
+
+    def remaining(self, manifests: List[dict]) -> List[dict]:
+        """
+        Return the given manifests which have not already been applied.
+        """
+        return [m for m in manifests if object_key(m) not in self.objects]
+
+    def complete(self, phase: str, manifests: List[dict]) -> None:
+        """
+        Record that the given phase completed, having applied the given
+        manifests.
+        """
+        self.phases.append(phase)
+        self.objects.update(object_key(m) for m in manifests)
+        self.save()
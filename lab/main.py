@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
+# pylint: disable=too-many-lines
 
 import argparse
+import atexit
 import json
 import logging
 import os
 import subprocess
+import sys
 import time
 from pathlib import Path
 from time import sleep
-from typing import List, Sequence
+from typing import Dict, List, Optional, Sequence, Set
 
 import jinja2
 import kubernetes.client  # type: ignore
@@ -16,29 +19,101 @@ import kubernetes.config  # type: ignore
 import tenacity
 import yaml
 
+from apiclient import METRICS, ApiClientSettings
+from apply_errors import (
+    PermanentApplyError,
+    WebhookNotReadyError,
+    classify_apply_error,
+    wait_for_webhooks,
+)
+from arma3_cache import export_arma3_mods, import_arma3_mods
+from arma3_restart import restart_arma3
 from config import Arma3Mod, LabConfig
+from dashboards import is_dashboard, load_dashboard
+from index import (
+    LabelSelector,
+    ManifestIndex,
+    Selector,
+    config_fingerprint,
+    object_key,
+)
+from journal import DeployJournal, deploy_fingerprint
+from prepull import ImagePrePull, workload_images
+from prune import check_prunable, prune, record_apply_set
+from schemas import validate_manifests
+from targets import Target, TargetResult, resolve_targets, run_on_targets, target_logger
+from transforms import run_transforms
+from usage import UsageResources, load_usage
+from watch import watch_manifests
+
+ARMA3_CONTENT_DIRECTORY = Path("/opt/arma3/steamapps/workshop/content/")
+# Records the hashes of each mod's files at its last successful download
+ARMA3_MOD_MANIFEST_DIRECTORY = Path("/opt/arma3/steamapps/workshop/.manifests/")
 
 
 def _parse_args() -> argparse.Namespace:
+    # pylint: disable=too-many-statements
     """Parse command line arguments"""
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-c",
         "--config",
-        action="store",
+        dest="configs",
+        action="append",
         metavar="FILE",
-        required=True,
-        default=os.environ.get("LABCONFIG"),
-        help="Lab config file",
+        help="Lab config file. Give once to share between all targets, or once per target",
     )
     parser.add_argument(
         "-k",
         "--kubeconfig",
-        action="store",
+        dest="kubeconfigs",
+        action="append",
         metavar="FILE",
-        required=True,
-        default=os.environ.get("KUBECONFIG"),
-        help="Kubernetes config file",
+        help="Kubernetes config file. May be given multiple times to deploy to multiple clusters",
+    )
+    parser.add_argument(
+        "--context",
+        dest="contexts",
+        action="append",
+        default=[],
+        metavar="CONTEXT",
+        help="Kubernetes context. Give once per kubeconfig, or multiple times with a single kubeconfig",
+    )
+    parser.add_argument(
+        "--api-pool-size",
+        action="store",
+        type=int,
+        default=ApiClientSettings.pool_size,
+        metavar="N",
+        help="Maximum concurrent connections to each Kubernetes API server",
+    )
+    parser.add_argument(
+        "--api-connect-timeout",
+        action="store",
+        type=float,
+        default=ApiClientSettings.connect_timeout,
+        metavar="SECONDS",
+        help="Timeout for connecting to the Kubernetes API server",
+    )
+    parser.add_argument(
+        "--api-read-timeout",
+        action="store",
+        type=float,
+        default=ApiClientSettings.read_timeout,
+        metavar="SECONDS",
+        help="Timeout for Kubernetes API responses",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print latency histograms of Kubernetes API requests at exit",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        metavar="DIR",
+        default=os.environ.get("LABCACHE", ".cache"),
+        help="Directory for persistent caches",
     )
 
     subparsers = parser.add_subparsers(required=True, dest="command")
@@ -53,10 +128,184 @@ def _parse_args() -> argparse.Namespace:
         required=True,
         help="Kubernetes YAML or JSON manifest file to deploy",
     )
+    deploy_parser.add_argument(
+        "--namespace",
+        dest="namespaces",
+        action="append",
+        default=[],
+        metavar="NAMESPACE",
+        help="Only deploy objects in this Namespace",
+    )
+    deploy_parser.add_argument(
+        "--kind",
+        dest="kinds",
+        action="append",
+        default=[],
+        metavar="KIND",
+        help="Only deploy objects of this kind",
+    )
+    deploy_parser.add_argument(
+        "--name",
+        dest="names",
+        action="append",
+        default=[],
+        metavar="NAME",
+        help="Only deploy objects with this name",
+    )
+    deploy_parser.add_argument(
+        "-l",
+        "--selector",
+        action="store",
+        metavar="SELECTOR",
+        help="Only deploy objects matching this label selector",
+    )
+    deploy_parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help="Keep running and apply changes to manifests or lab config as they are saved",
+    )
+    deploy_parser.add_argument(
+        "--debounce",
+        action="store",
+        type=float,
+        default=0.5,
+        metavar="SECONDS",
+        help="In watch mode, wait until files have been unchanged for this long before applying",
+    )
+    deploy_parser.add_argument(
+        "--no-validate",
+        dest="validate",
+        action="store_false",
+        help="Do not validate manifests against API schemas before applying",
+    )
+    deploy_parser.add_argument(
+        "--no-pre-pull",
+        dest="pre_pull",
+        action="store_false",
+        help="Do not pull workload images onto every Node before applying workloads. Images are never pre-pulled with --watch.",
+    )
+    deploy_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted deploy, skipping the phases it completed, unless the manifests or lab config have changed",
+    )
+    deploy_parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Delete previously deployed objects which are no longer in the manifests. The manifest paths must be the ones previously deployed.",
+    )
+    deploy_parser.add_argument(
+        "--prune-dry-run",
+        action="store_true",
+        help="List the objects which --prune would delete, without applying or deleting anything",
+    )
+
+    update_parser = subparsers.add_parser(
+        "update-arma3-mods", help="Install or update Arma 3 mods"
+    )
+    update_parser.add_argument(
+        "--no-restart",
+        dest="restart",
+        action="store_false",
+        help="Do not restart Arma 3 to load the updated mods",
+    )
+    restart_parser = subparsers.add_parser(
+        "restart-arma3",
+        help="Apply the Arma 3 StatefulSets and restart the server, then the headless clients",
+    )
+    for arma3_parser in (update_parser, restart_parser):
+        arma3_parser.add_argument(
+            "-m",
+            "--manifest",
+            dest="manifests",
+            action="append",
+            metavar="FILE",
+            help="Kubernetes YAML or JSON manifest file containing the Arma 3 StatefulSets (default: deploy/)",
+        )
+        arma3_parser.add_argument(
+            "--restart-timeout",
+            action="store",
+            type=int,
+            default=1800,
+            metavar="SECONDS",
+            help="Give up if Arma 3 Pods are not Ready after this long",
+        )
+    subparsers.add_parser(
+        "verify-arma3-mods",
+        help="Verify Arma 3 mods' files and download any which are damaged",
+    )
 
-    subparsers.add_parser("update-arma3-mods", help="Install or update Arma 3 mods")
+    export_parser = subparsers.add_parser(
+        "export-arma3-mods", help="Export Arma 3 mods from the cluster to a host cache"
+    )
+    import_parser = subparsers.add_parser(
+        "import-arma3-mods",
+        help="Import Arma 3 mods from a host cache into the cluster",
+    )
+    for mod_cache_parser in (export_parser, import_parser):
+        mod_cache_parser.add_argument(
+            "--mod-cache",
+            action="store",
+            metavar="DIR",
+            help="Directory of the Arma 3 mod cache (default: arma3-mods in the cache directory)",
+        )
+    import_parser.add_argument(
+        "--chunk-size",
+        action="store",
+        type=int,
+        default=32,
+        metavar="MIB",
+        help="Upload mods in chunks of this many MiB; an interrupted import resumes from the last complete chunk",
+    )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not args.configs and os.environ.get("LABCONFIG"):
+        args.configs = [os.environ["LABCONFIG"]]
+    if not args.configs:
+        parser.error("a lab config file is required")
+    if not args.kubeconfigs and os.environ.get("KUBECONFIG"):
+        args.kubeconfigs = [os.environ["KUBECONFIG"]]
+    if not args.kubeconfigs:
+        parser.error("a Kubernetes config file is required")
+    try:
+        args.targets = resolve_targets(
+            kubeconfigs=args.kubeconfigs, contexts=args.contexts, configs=args.configs
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    args.api_client_settings = ApiClientSettings(
+        pool_size=args.api_pool_size,
+        connect_timeout=args.api_connect_timeout,
+        read_timeout=args.api_read_timeout,
+    )
+    if args.command != "deploy" and len(args.targets) > 1:
+        parser.error(f"{args.command} only supports a single target")
+    if args.command == "deploy":
+        _check_deploy_args(parser, args)
+    return args
+
+
+def _check_deploy_args(
+    parser: argparse.ArgumentParser, args: argparse.Namespace
+) -> None:
+    if args.selector:
+        try:
+            LabelSelector(args.selector)
+        except ValueError as e:
+            parser.error(str(e))
+    selected = args.namespaces or args.kinds or args.names or args.selector
+    if args.watch and len(set(args.configs)) > 1:
+        parser.error("--watch only supports a single lab config")
+    if args.watch and selected:
+        parser.error("--watch cannot be combined with selectors")
+    if args.watch and args.resume:
+        parser.error("--resume cannot be combined with --watch")
+    if args.prune or args.prune_dry_run:
+        if args.watch:
+            parser.error("--prune cannot be combined with --watch")
+        if selected:
+            parser.error("--prune cannot be combined with selectors")
 
 
 def parse_manifests(
@@ -69,31 +318,81 @@ def parse_manifests(
     for path in paths:
         if path.is_dir():
             manifests.extend(
-                parse_manifests(list(path.iterdir()), config=config, logger=logger)
+                parse_manifests(sorted(path.iterdir()), config=config, logger=logger)
             )
         elif path.is_file():
-            logger.info(f"Loading manifest {path}...")
-            with open(path, "r", encoding="utf-8") as f:
-                raw_document = f.read()
-            try:
-                template = jinja2.Template(raw_document).render(
-                    json.loads(config.json_with_plaintext_secrets())
-                )
-            except jinja2.exceptions.TemplateSyntaxError:
-                template = raw_document
-            documents = yaml.safe_load_all(template)
-            for document in documents:
-                if document is None:
-                    continue
-                if document["kind"].endswith("List"):
-                    # Easier to deal with unwrapped lists
-                    manifests.extend(document["items"])
-                else:
-                    manifests.append(document)
+            manifests.extend(_load_manifest_file(path, config=config, logger=logger))
+    return manifests
+
+
+def _load_manifest_file(
+    path: Path, *, config: LabConfig, logger: logging.Logger
+) -> List[dict]:
+    if is_dashboard(path):
+        logger.info(f"Loading Grafana dashboard {path}...")
+        return [load_dashboard(path)]
+    logger.info(f"Loading manifest {path}...")
+    with open(path, "r", encoding="utf-8") as f:
+        raw_document = f.read()
+    try:
+        template = jinja2.Template(raw_document).render(
+            json.loads(config.json_with_plaintext_secrets())
+        )
+    except jinja2.exceptions.TemplateSyntaxError:
+        template = raw_document
+    manifests: List[dict] = []
+    for document in yaml.safe_load_all(template):
+        if document is None:
+            continue
+        if document["kind"].endswith("List"):
+            # Easier to deal with unwrapped lists
+            manifests.extend(document["items"])
+        else:
+            manifests.append(document)
     return manifests
 
 
-def kubectl_apply(manifests: List[dict], *, logger: logging.Logger) -> None:
+def select_manifests(
+    paths: Sequence[Path],
+    *,
+    selector: Selector,
+    index_path: Path,
+    config: LabConfig,
+    logger: logging.Logger,
+) -> List[dict]:
+    """
+    Load only the objects matching the given selector from the given paths,
+    along with the Namespaces and CustomResourceDefinitions they depend on.
+    A persistent index is used to avoid reading files which do not contain
+    any of the selected objects.
+    """
+    index = ManifestIndex.load(index_path, logger=logger)
+    index.refresh(
+        paths,
+        config=config,
+        load=lambda p: _load_manifest_file(p, config=config, logger=logger),
+        logger=logger,
+    )
+    index.save(index_path)
+
+    manifests: List[dict] = []
+    for path, keys in index.select(selector, paths).items():
+        manifests.extend(
+            m
+            for m in _load_manifest_file(path, config=config, logger=logger)
+            if object_key(m) in keys
+        )
+    logger.info(f"Selected {len(manifests)} object(s)")
+    return manifests
+
+
+def kubectl_apply(
+    manifests: List[dict],
+    *,
+    target: Target,
+    api_client: kubernetes.client.ApiClient,
+    logger: logging.Logger,
+) -> None:
     if not manifests:
         return
     for manifest in manifests:
@@ -104,15 +403,27 @@ def kubectl_apply(manifests: List[dict], *, logger: logging.Logger) -> None:
         message += "..."
         logger.info(message)
 
+    backoff = tenacity.wait_exponential(multiplier=2, max=10)
+
+    def wait(retry_state: tenacity.RetryCallState) -> float:
+        # No need to back off if we've already waited for a webhook
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        if isinstance(error, WebhookNotReadyError) and error.waited:
+            return 0
+        return backoff(retry_state)
+
     for attempt in tenacity.Retrying(
         stop=tenacity.stop_after_delay(300),
-        wait=tenacity.wait_exponential(multiplier=2, max=10),
+        wait=wait,
+        retry=tenacity.retry_if_not_exception_type(PermanentApplyError),
+        reraise=True,
     ):
         with attempt:
             try:
                 subprocess.run(
                     [
                         "kubectl",
+                        *target.kubectl_args(),
                         "apply",
                         "--server-side=true",
                         "--force-conflicts=true",
@@ -134,7 +445,14 @@ def kubectl_apply(manifests: List[dict], *, logger: logging.Logger) -> None:
                         )
                     )
                 )
-                raise
+                error = classify_apply_error(e.stderr.decode("utf-8"))
+                if isinstance(error, PermanentApplyError):
+                    logger.error("This error is permanent, not retrying")
+                elif isinstance(error, WebhookNotReadyError):
+                    wait_for_webhooks(
+                        error, api_client=api_client, timeout=60, logger=logger
+                    )
+                raise error from e
     logger.info(f"Applied {len(manifests)} manifest(s) successfully")
 
 
@@ -202,88 +520,178 @@ def _wait_for_crd(
 def customize_manifests(
     manifests: List[dict], *, config: LabConfig, logger: logging.Logger
 ) -> List[dict]:
-    for manifest in manifests:
-        identity = f"{manifest['kind']} {manifest['metadata']['name']}"
-        if manifest["metadata"].get("namespace"):
-            identity += f" in Namespace {manifest['metadata']['namespace']}"
-
-        if manifest["kind"] in ("Deployment", "StatefulSet", "Job", "CronJob"):
-            pod_template = manifest["spec"]["template"]
-
-            for container in pod_template["spec"]["containers"]:
-                if container.get("imagePullPolicy") != "IfNotPresent":
-                    logger.info(
-                        f"Customizing {identity}: Setting image pull policy to IfNotPresent to conserve network bandwidth"
-                    )
-                    container["imagePullPolicy"] = "IfNotPresent"
-        if manifest["kind"] == "Ingress":
-            # https://cert-manager.io/docs/usage/ingress/
-            logger.info(
-                f"Customizing {identity}: Configuring TLS using ClusterIssuer {config.cert_manager.issuer.value}"
-            )
-            manifest["spec"]["ingressClassName"] = "nginx"
-            if "annotations" not in manifest["metadata"]:
-                manifest["metadata"]["annotations"] = {}
-            manifest["metadata"]["annotations"].update(
-                {
-                    "cert-manager.io/cluster-issuer": config.cert_manager.issuer.value,
-                }
-            )
-            manifest["spec"]["tls"] = [
-                {
-                    "hosts": [config.nginx.base_url.host],
-                    "secretName": f"{manifest['metadata']['name']}-ingress-tls",
-                }
-            ]
-            for rule in manifest["spec"].get("rules", []):
-                rule["host"] = config.nginx.base_url.host
-        if (
-            config.arma3.mods
-            and manifest["metadata"].get("namespace") == "arma3"
-            and manifest["kind"] == "StatefulSet"
-            and manifest["metadata"]["name"] in ("arma3", "arma3-headless-client")
-        ):
-            logger.info(
-                f"Customizing {identity}: Adding Arma 3 mods to arma3server arguments"
-            )
-            for container in manifest["spec"]["template"]["spec"]["containers"]:
-                if container["name"] == "arma3":
-                    container["args"].append(
-                        "-mod=" + ";".join(f"@{mod.name}" for mod in config.arma3.mods)
-                    )
-
+    """
+    Apply the customizations registered in the transforms module, and
+    optionally set container resources from usage.
+    """
+    if not config.resources.enabled:
+        return run_transforms(manifests, config=config, logger=logger)
+    try:
+        usage = load_usage(config, logger=logger)
+    except (OSError, KeyError, ValueError) as e:
+        # OSError includes URLError, e.g. Prometheus being unreachable
+        logger.warning(
+            f"Could not load container usage, leaving resources as they are: {e}"
+        )
+        return run_transforms(manifests, config=config, logger=logger)
+    usage_resources = UsageResources(usage, settings=config.resources)
+    manifests = run_transforms(
+        manifests,
+        config=config,
+        logger=logger,
+        extra_passes=[usage_resources.transform_pass],
+    )
+    usage_resources.log_report(logger)
     return manifests
 
 
 def deploy_manifests(
     manifests: List[dict],
     *,
-    api_extensions_api: kubernetes.client.ApiextensionsV1Api,
+    target: Target,
+    api_client: kubernetes.client.ApiClient,
+    paths: Sequence[Path],
+    config: LabConfig,
+    journal_directory: Optional[Path],
+    resume: bool,
+    pre_pull: bool,
+    prune_orphans: bool,
+    prune_dry_run: bool,
     logger: logging.Logger,
 ) -> None:
-    def filter_manifests(*args: str) -> List[dict]:
-        return [m for m in manifests if m["kind"] in args]
+    # pylint: disable=too-many-arguments,too-many-locals
+    """
+    Apply the given manifests to the given target in phases. Without a
+    journal directory, progress is not journalled and cannot be resumed.
+    """
+    if prune_dry_run:
+        prune(
+            manifests,
+            paths=paths,
+            api_client=api_client,
+            dry_run=True,
+            timeout=300,
+            logger=logger,
+        )
+        return
+    if prune_orphans:
+        # Refuse before applying anything, rather than after
+        check_prunable(paths, api_client=api_client)
+    if journal_directory is None:
+        journal = DeployJournal(target=target.name, fingerprint="")
+    else:
+        journal = DeployJournal.start(
+            journal_directory,
+            target=target.name,
+            fingerprint=deploy_fingerprint(paths, config=config, manifests=manifests),
+            resume=resume,
+            logger=logger,
+        )
+    record_apply_set(manifests, paths=paths, api_client=api_client, logger=logger)
 
-    kubectl_apply(filter_manifests("Namespace"), logger=logger)
+    def apply_phase(*kinds: str) -> None:
+        phase = ", ".join(kinds)
+        if journal.is_complete(phase):
+            logger.info(f"Skipping {phase} phase, already applied")
+            return
+        phase_manifests = [m for m in manifests if m["kind"] in kinds]
+        kubectl_apply(
+            phase_manifests, target=target, api_client=api_client, logger=logger
+        )
+        if "CustomResourceDefinition" in kinds:
+            for crd_manifest in phase_manifests:
+                _wait_for_crd(
+                    crd_manifest["metadata"]["name"],
+                    api_extensions_api=kubernetes.client.ApiextensionsV1Api(api_client),
+                    logger=logger,
+                )
+            logger.info(f"Verified {len(phase_manifests)} CustomResourceDefinitions")
+        journal.complete(phase, phase_manifests)
 
-    crd_manifests = filter_manifests("CustomResourceDefinition")
-    kubectl_apply(crd_manifests, logger=logger)
-    for crd_manifest in crd_manifests:
-        _wait_for_crd(
-            crd_manifest["metadata"]["name"],
-            api_extensions_api=api_extensions_api,
-            logger=logger,
+    # Objects applied by the earlier phases are not applied again
+    remaining = journal.remaining(manifests)
+
+    # Pull images while the earlier phases are applied
+    image_pre_pull = None
+    images = workload_images(remaining)
+    if pre_pull and images:
+        image_pre_pull = ImagePrePull(
+            images, api_client=api_client, timeout=600, logger=logger
         )
-    logger.info(f"Verified {len(crd_manifests)} CustomResourceDefinitions")
+        try:
+            image_pre_pull.start()
+        except kubernetes.client.rest.ApiException as e:
+            logger.warning(f"Could not pre-pull images, continuing anyway: {e}")
+            image_pre_pull = None
 
-    kubectl_apply(
-        filter_manifests("ClusterRole", "Role", "ServiceAccount"), logger=logger
-    )
-    kubectl_apply(filter_manifests("ClusterRoleBinding", "RoleBinding"), logger=logger)
-    kubectl_apply(filter_manifests("ConfigMap", "Secret", "Service"), logger=logger)
+    try:
+        apply_phase("Namespace")
+        apply_phase("CustomResourceDefinition")
+        apply_phase("ClusterRole", "Role", "ServiceAccount")
+        apply_phase("ClusterRoleBinding", "RoleBinding")
+        apply_phase("ConfigMap", "Secret", "Service")
+        if image_pre_pull is not None:
+            image_pre_pull.wait()
+    finally:
+        if image_pre_pull is not None:
+            image_pre_pull.stop()
     # TODO delete nginx batch jobs from apiserver before redeploying nginx due
     # to immutability
-    kubectl_apply(manifests, logger=logger)
+    if not journal.is_complete("final"):
+        remaining = journal.remaining(manifests)
+        kubectl_apply(remaining, target=target, api_client=api_client, logger=logger)
+        journal.complete("final", remaining)
+    if prune_orphans:
+        prune(
+            manifests,
+            paths=paths,
+            api_client=api_client,
+            dry_run=False,
+            timeout=300,
+            logger=logger,
+        )
+    journal.remove()
+
+
+def deploy_to_targets(
+    manifests: Dict[str, List[dict]],
+    *,
+    paths: Sequence[Path],
+    targets: Sequence[Target],
+    configs: Dict[Path, LabConfig],
+    settings: ApiClientSettings,
+    journal_directory: Optional[Path],
+    resume: bool,
+    pre_pull: bool,
+    prune_orphans: bool,
+    prune_dry_run: bool,
+    logger: logging.Logger,
+) -> List[TargetResult]:
+    # pylint: disable=too-many-arguments
+    """
+    Deploy to each target concurrently.
+
+    :param manifests: Rendered manifests keyed by LabConfig fingerprint.
+    :param paths: The manifest paths the manifests were rendered from.
+    """
+
+    def deploy(target: Target) -> None:
+        config = configs[target.config_path]
+        deploy_manifests(
+            manifests[config_fingerprint(config)],
+            target=target,
+            api_client=target.api_client(settings),
+            paths=paths,
+            config=config,
+            journal_directory=journal_directory,
+            resume=resume,
+            pre_pull=pre_pull,
+            prune_orphans=prune_orphans,
+            prune_dry_run=prune_dry_run,
+            logger=target_logger(target, targets, logger=logger),
+        )
+
+    return run_on_targets(targets, deploy, logger=logger)
 
 
 @tenacity.retry(
@@ -296,6 +704,7 @@ def _update_arma3_mod(
     mod: Arma3Mod,
     core_api: kubernetes.client.CoreV1Api,
     logger: logging.Logger,
+    validate: bool = False,
 ) -> None:
     logger.info(
         f"Updating {mod.name} ({mod.workshop_id}) in volume for Pod {pod.metadata.name}..."
@@ -307,7 +716,7 @@ def _update_arma3_mod(
         command=[
             "bash",
             "-c",
-            f"steamcmd +force_install_dir /opt/arma3 +login $STEAM_USERNAME $STEAM_PASSWORD +workshop_download_item $ARMA3_APPID {mod.workshop_id} +quit",
+            f"steamcmd +force_install_dir /opt/arma3 +login $STEAM_USERNAME $STEAM_PASSWORD +workshop_download_item $ARMA3_APPID {mod.workshop_id}{' validate' if validate else ''} +quit",
         ],
         logger=logger,
     )
@@ -321,12 +730,215 @@ def _update_arma3_mod(
         raise RuntimeError(
             f"Steam failed to download item {mod.workshop_id}:\n{output}"
         )
+    _record_arma3_mod_manifests(pod=pod, mods=[mod], core_api=core_api, logger=logger)
 
     logger.info(
         f"{mod.name} ({mod.workshop_id}) in volume for Pod {pod.metadata.name} is up to date"
     )
 
 
+def _hash_arma3_mods(mods: List[Arma3Mod]) -> str:
+    """
+    Return a shell command which hashes the files of the given mods in
+    parallel, for use in the content directory.
+    """
+    ids = " ".join(str(mod.workshop_id) for mod in mods)
+    return f'find {ids} -type f -print0 | xargs -0 -r -n 64 -P "$(nproc)" sha256sum | LC_ALL=C sort -k 2'
+
+
+def _record_arma3_mod_manifests(
+    *,
+    pod: kubernetes.client.models.V1Pod,
+    mods: List[Arma3Mod],
+    core_api: kubernetes.client.CoreV1Api,
+    logger: logging.Logger,
+) -> None:
+    logger.info(
+        f"Recording file hashes of {len(mods)} mod(s) in volume for Pod {pod.metadata.name}..."
+    )
+    kubectl_exec(
+        core_api=core_api,
+        pod=pod,
+        container_name="steamcmd",
+        command=[
+            "bash",
+            "-c",
+            "\n".join(
+                [
+                    "set -eo pipefail",
+                    f"mkdir -p {ARMA3_MOD_MANIFEST_DIRECTORY}",
+                    f"cd {ARMA3_CONTENT_DIRECTORY}/$ARMA3_APPID",
+                    *(
+                        f"if [ -d {mod.workshop_id} ]; then {_hash_arma3_mods([mod])} > {ARMA3_MOD_MANIFEST_DIRECTORY}/{mod.workshop_id}.sha256; fi"
+                        for mod in mods
+                    ),
+                ]
+            ),
+        ],
+        logger=logger,
+    )
+
+
+def _verify_arma3_mods(
+    *,
+    pod: kubernetes.client.models.V1Pod,
+    mods: List[Arma3Mod],
+    core_api: kubernetes.client.CoreV1Api,
+    logger: logging.Logger,
+) -> List[Arma3Mod]:
+    """
+    Hash the files of the given mods and compare them to the hashes recorded
+    at their last download.
+
+    :return: The mods with mismatched or missing files, or no recorded hashes.
+    """
+    logger.info(
+        f"Verifying {len(mods)} mod(s) in volume for Pod {pod.metadata.name}..."
+    )
+    manifests = " ".join(
+        f"{ARMA3_MOD_MANIFEST_DIRECTORY}/{mod.workshop_id}.sha256" for mod in mods
+    )
+    # A single exec hashes every mod, then diffs the hashes against the
+    # recorded hashes. Diff lines start with < or > followed by the hash and a
+    # path starting with the mod's workshop ID.
+    output = kubectl_exec(
+        core_api=core_api,
+        pod=pod,
+        container_name="steamcmd",
+        command=[
+            "bash",
+            "-c",
+            "\n".join(
+                [
+                    f"cd {ARMA3_CONTENT_DIRECTORY}/$ARMA3_APPID",
+                    *(
+                        f"test -f {ARMA3_MOD_MANIFEST_DIRECTORY}/{mod.workshop_id}.sha256 || echo 'unrecorded {mod.workshop_id}'"
+                        for mod in mods
+                    ),
+                    f"diff <(cat {manifests} 2>/dev/null | LC_ALL=C sort -k 2) <({_hash_arma3_mods(mods)} 2>/dev/null) || true",
+                ]
+            ),
+        ],
+        logger=logger,
+    )
+
+    unrecorded = set()
+    mismatched: Dict[str, Set[str]] = {}
+    for line in output.splitlines():
+        fields = line.split(maxsplit=2)
+        if len(fields) == 2 and fields[0] == "unrecorded":
+            unrecorded.add(fields[1])
+        elif len(fields) == 3 and fields[0] in ("<", ">"):
+            workshop_id = fields[2].split("/")[0]
+            mismatched.setdefault(workshop_id, set()).add(fields[2])
+
+    bad = []
+    for mod in mods:
+        if str(mod.workshop_id) in unrecorded:
+            logger.warning(
+                f"{mod.name} ({mod.workshop_id}) has no recorded file hashes in volume for Pod {pod.metadata.name}"
+            )
+            bad.append(mod)
+        elif str(mod.workshop_id) in mismatched:
+            logger.warning(
+                f"{mod.name} ({mod.workshop_id}) has {len(mismatched[str(mod.workshop_id)])} mismatched or missing file(s) in volume for Pod {pod.metadata.name}"
+            )
+            bad.append(mod)
+        else:
+            logger.info(
+                f"{mod.name} ({mod.workshop_id}) in volume for Pod {pod.metadata.name} is intact"
+            )
+    return bad
+
+
+def _list_arma3_pods(
+    component: str, *, core_api: kubernetes.client.CoreV1Api
+) -> List[kubernetes.client.models.V1Pod]:
+    return core_api.list_namespaced_pod(
+        namespace="arma3",
+        label_selector=f"app.kubernetes.io/name=arma3,app.kubernetes.io/component={component}",
+    ).items
+
+
+def _link_arma3_mod(
+    *,
+    pod: kubernetes.client.models.V1Pod,
+    mod: Arma3Mod,
+    core_api: kubernetes.client.CoreV1Api,
+    logger: logging.Logger,
+) -> None:
+    logger.info(f"Linking {mod.name} in volume for Pod {pod.metadata.name}...")
+    kubectl_exec(
+        core_api=core_api,
+        pod=pod,
+        container_name="steamcmd",
+        command=[
+            "bash",
+            "-c",
+            # Note we're linking to a "lower" directory - see below for why
+            " && ".join(
+                [
+                    f"rm -f /opt/arma3/@{mod.name}",
+                    f"ln -sf {ARMA3_CONTENT_DIRECTORY}/lower/{mod.workshop_id} /opt/arma3/@{mod.name}",
+                ]
+            ),
+        ],
+        logger=logger,
+    )
+
+
+def _rebuild_arma3_lowercase_tree(
+    *,
+    pod: kubernetes.client.models.V1Pod,
+    core_api: kubernetes.client.CoreV1Api,
+    logger: logging.Logger,
+) -> None:
+    # SORCERY LIES WITHIN
+    #
+    # While the Arma 3 game itself will happily run on a case-sensitive
+    # filesystem, many popular mods are coded by Windows devs and are
+    # only tested on a case-insensitive filesystem. If you try to run
+    # these mods out of the box, the server will fail to load any file
+    # with an uppercase character in the path, causing all sorts of
+    # crazy bugs like objects not appearing in game. CUP even includes
+    # an apologetic note with a suggestion to recursively rename all
+    # its files to lowercase on Linux. However, this would cause Steam
+    # to needlessly redownload the renamed files on each invocation.
+    #
+    # Instead, we use cp to create a parallel directory tree where all
+    # non-directory files are symbolic links to the original, then use
+    # find + (perl) rename to lowercase all the filenames in the
+    # parallel tree. We'll point Arma at the lowercase version and
+    # Steam at the original mixed-case.
+    logger.info(
+        f"Rebuilding lowercase symbolic link tree in volume for Pod {pod.metadata.name}..."
+    )
+    content_directory = ARMA3_CONTENT_DIRECTORY
+    kubectl_exec(
+        core_api=core_api,
+        pod=pod,
+        container_name="steamcmd",
+        command=[
+            "bash",
+            "-c",
+            " && ".join(
+                [
+                    "apt-get -y update",
+                    "apt-get -y install rename",
+                    f"rm -rf {content_directory}/lower",
+                    f"cp -asr {content_directory}/$ARMA3_APPID {content_directory}/lower",
+                    # Note the use of -depth to work from the bottom up
+                    # so we rename the contents of a directory before
+                    # the directory. Otherwise we would change the
+                    # paths of files we haven't yet processed.
+                    f"find {content_directory}/lower -depth -execdir rename 'y/A-Z/a-z/' '{{}}' ';'",
+                ]
+            ),
+        ],
+        logger=logger,
+    )
+
+
 def update_arma3_mods(
     *,
     mods: List[Arma3Mod],
@@ -335,118 +947,254 @@ def update_arma3_mods(
 ) -> None:
     for component in ("server", "headless-client"):
         logger.info(f"Downloading mods for Arma 3 component: {component}")
-        content_directory = Path("/opt/arma3/steamapps/workshop/content/")
-        pods = core_api.list_namespaced_pod(
-            namespace="arma3",
-            label_selector=f"app.kubernetes.io/name=arma3,app.kubernetes.io/component={component}",
-        )
-        for pod in pods.items:
+        for pod in _list_arma3_pods(component, core_api=core_api):
             for mod in mods:
                 _update_arma3_mod(pod=pod, mod=mod, core_api=core_api, logger=logger)
+                _link_arma3_mod(pod=pod, mod=mod, core_api=core_api, logger=logger)
+            _rebuild_arma3_lowercase_tree(pod=pod, core_api=core_api, logger=logger)
 
-                logger.info(
-                    f"Linking {mod.name} in volume for Pod {pod.metadata.name}..."
-                )
-                kubectl_exec(
-                    core_api=core_api,
-                    pod=pod,
-                    container_name="steamcmd",
-                    command=[
-                        "bash",
-                        "-c",
-                        # Note we're linking to a "lower" directory - see below for why
-                        " && ".join(
-                            [
-                                f"rm -f /opt/arma3/@{mod.name}",
-                                f"ln -sf {content_directory}/lower/{mod.workshop_id} /opt/arma3/@{mod.name}",
-                            ]
-                        ),
-                    ],
-                    logger=logger,
-                )
+    logger.info("Updated Arma 3 mods.")
 
-            # SORCERY LIES WITHIN
-            #
-            # While the Arma 3 game itself will happily run on a case-sensitive
-            # filesystem, many popular mods are coded by Windows devs and are
-            # only tested on a case-insensitive filesystem. If you try to run
-            # these mods out of the box, the server will fail to load any file
-            # with an uppercase character in the path, causing all sorts of
-            # crazy bugs like objects not appearing in game. CUP even includes
-            # an apologetic note with a suggestion to recursively rename all
-            # its files to lowercase on Linux. However, this would cause Steam
-            # to needlessly redownload the renamed files on each invocation.
-            #
-            # Instead, we use cp to create a parallel directory tree where all
-            # non-directory files are symbolic links to the original, then use
-            # find + (perl) rename to lowercase all the filenames in the
-            # parallel tree. We'll point Arma at the lowercase version and
-            # Steam at the original mixed-case.
-            logger.info(
-                f"Rebuilding lowercase symbolic link tree in volume for Pod {pod.metadata.name}..."
-            )
-            kubectl_exec(
-                core_api=core_api,
-                pod=pod,
-                container_name="steamcmd",
-                command=[
-                    "bash",
-                    "-c",
-                    " && ".join(
-                        [
-                            "apt-get -y update",
-                            "apt-get -y install rename",
-                            f"rm -rf {content_directory}/lower",
-                            f"cp -asr {content_directory}/$ARMA3_APPID {content_directory}/lower",
-                            # Note the use of -depth to work from the bottom up
-                            # so we rename the contents of a directory before
-                            # the directory. Otherwise we would change the
-                            # paths of files we haven't yet processed.
-                            f"find {content_directory}/lower -depth -execdir rename 'y/A-Z/a-z/' '{{}}' ';'",
-                        ]
-                    ),
-                ],
-                logger=logger,
-            )
 
-    logger.info(
-        "Updated Arma 3 mods. Manifest changes must also be deployed. Run `kubectl -n arma3 delete pod -l app.kubernetes.io/name=arma3` to reload mods."
+def deploy_arma3_restart(
+    paths: List[Path],
+    *,
+    target: Target,
+    config: LabConfig,
+    settings: ApiClientSettings,
+    index_path: Path,
+    timeout: int,
+    logger: logging.Logger,
+) -> None:
+    # pylint: disable=too-many-arguments
+    """
+    Apply the Arma 3 StatefulSets, so that they load the configured mods, and
+    restart Arma 3.
+    """
+    manifests = select_manifests(
+        paths,
+        selector=Selector(namespaces=["arma3"], kinds=["StatefulSet"]),
+        index_path=index_path,
+        config=config,
+        logger=logger,
     )
+    statefulsets = [
+        m
+        for m in customize_manifests(manifests, config=config, logger=logger)
+        if m["kind"] == "StatefulSet"
+    ]
+    api_client = target.api_client(settings)
+    kubectl_apply(statefulsets, target=target, api_client=api_client, logger=logger)
+    restart_arma3(api_client=api_client, timeout=timeout, logger=logger)
+
+
+def verify_arma3_mods(
+    *,
+    mods: List[Arma3Mod],
+    core_api: kubernetes.client.CoreV1Api,
+    logger: logging.Logger,
+) -> None:
+    for component in ("server", "headless-client"):
+        logger.info(f"Verifying mods for Arma 3 component: {component}")
+        for pod in _list_arma3_pods(component, core_api=core_api):
+            bad = _verify_arma3_mods(
+                pod=pod, mods=mods, core_api=core_api, logger=logger
+            )
+            # Steam's validate option only downloads the files which differ
+            for mod in bad:
+                _update_arma3_mod(
+                    pod=pod, mod=mod, core_api=core_api, logger=logger, validate=True
+                )
+            if bad:
+                _rebuild_arma3_lowercase_tree(pod=pod, core_api=core_api, logger=logger)
+
+    logger.info("Verified Arma 3 mods.")
 
 
 def main() -> None:
+    # pylint: disable=too-many-branches,too-many-locals,too-many-statements
     """Entrypoint function"""
     args = _parse_args()
+    targets: List[Target] = args.targets
 
-    assert args.kubeconfig
-    kubernetes.config.load_kube_config(config_file=args.kubeconfig)
-    assert args.config
-    config: LabConfig = LabConfig.parse_file(Path(args.config))
-    LabConfig.validate(config)
+    configs: Dict[Path, LabConfig] = {}
+    for target in targets:
+        if target.config_path not in configs:
+            config = LabConfig.parse_file(target.config_path)
+            LabConfig.validate(config)
+            configs[target.config_path] = config
 
-    logging.basicConfig(
-        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s"
-    )
+    log_format = "%(asctime)s %(levelname)s: %(message)s"
+    if len(targets) > 1:
+        log_format = "%(asctime)s %(levelname)s [%(name)s]: %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_format)
     logger = logging.getLogger(__name__)
+    atexit.register(METRICS.log_summary, logger, histograms=args.profile)
+    schema_cache = Path(args.cache_dir) / "schemas"
+    journal_directory = Path(args.cache_dir) / "journals"
 
-    if args.command == "deploy":
-        deploy_manifests(
-            customize_manifests(
-                manifests=parse_manifests(
-                    [Path(m) for m in args.manifests], config=config, logger=logger
-                ),
+    if args.command == "deploy" and args.watch:
+        config_path = targets[0].config_path
+
+        def apply(manifests: List[dict], config: LabConfig) -> None:
+            if args.validate and validate_manifests(
+                manifests, cache_directory=schema_cache, logger=logger
+            ):
+                raise RuntimeError("Manifests failed validation")
+            configs[config_path] = config
+            results = deploy_to_targets(
+                {config_fingerprint(config): manifests},
+                paths=[Path(m) for m in args.manifests],
+                targets=targets,
+                configs=configs,
+                settings=args.api_client_settings,
+                # Each change is applied quickly and in full, so is not
+                # journalled, and images are left to be pulled as usual
+                journal_directory=None,
+                resume=False,
+                pre_pull=False,
+                prune_orphans=False,
+                prune_dry_run=False,
+                logger=logger,
+            )
+            if any(r.error for r in results):
+                raise RuntimeError("Deploy failed on one or more targets")
+
+        watch_manifests(
+            [Path(m) for m in args.manifests],
+            config_path=config_path,
+            config=configs[config_path],
+            render=lambda path, config: customize_manifests(
+                _load_manifest_file(path, config=config, logger=logger),
                 config=config,
                 logger=logger,
             ),
-            api_extensions_api=kubernetes.client.ApiextensionsV1Api(),
+            apply=apply,
+            debounce=args.debounce,
+            logger=logger,
+        )
+    elif args.command == "deploy":
+        paths = [Path(m) for m in args.manifests]
+        selector = Selector(
+            namespaces=args.namespaces,
+            kinds=args.kinds,
+            names=args.names,
+            labels=args.selector,
+        )
+        # Render once per distinct LabConfig, however many targets share it
+        rendered: Dict[str, List[dict]] = {}
+        for config in configs.values():
+            fingerprint = config_fingerprint(config)
+            if fingerprint in rendered:
+                continue
+            if selector.is_empty():
+                manifests = parse_manifests(paths, config=config, logger=logger)
+            else:
+                manifests = select_manifests(
+                    paths,
+                    selector=selector,
+                    index_path=Path(args.cache_dir) / "manifest-index.json",
+                    config=config,
+                    logger=logger,
+                )
+            rendered[fingerprint] = customize_manifests(
+                manifests=manifests, config=config, logger=logger
+            )
+        if args.validate:
+            problems = [
+                problem
+                for manifests in rendered.values()
+                for problem in validate_manifests(
+                    manifests, cache_directory=schema_cache, logger=logger
+                )
+            ]
+            if problems:
+                sys.exit(1)
+        results = deploy_to_targets(
+            rendered,
+            paths=paths,
+            targets=targets,
+            configs=configs,
+            settings=args.api_client_settings,
+            journal_directory=journal_directory,
+            resume=args.resume,
+            pre_pull=args.pre_pull,
+            prune_orphans=args.prune,
+            prune_dry_run=args.prune_dry_run,
             logger=logger,
         )
-    elif args.command == "update-arma3-mods":
-        update_arma3_mods(
-            mods=config.arma3.mods,
-            core_api=kubernetes.client.CoreV1Api(),
+        if any(r.error for r in results):
+            sys.exit(1)
+    elif args.command in ("update-arma3-mods", "restart-arma3"):
+        config = configs[targets[0].config_path]
+        if args.command == "update-arma3-mods":
+            update_arma3_mods(
+                mods=config.arma3.mods,
+                core_api=kubernetes.client.CoreV1Api(
+                    targets[0].api_client(args.api_client_settings)
+                ),
+                logger=logger,
+            )
+        if args.command == "restart-arma3" or args.restart:
+            deploy_arma3_restart(
+                [Path(m) for m in args.manifests or ["deploy/"]],
+                target=targets[0],
+                config=config,
+                settings=args.api_client_settings,
+                index_path=Path(args.cache_dir) / "manifest-index.json",
+                timeout=args.restart_timeout,
+                logger=logger,
+            )
+    elif args.command == "verify-arma3-mods":
+        verify_arma3_mods(
+            mods=configs[targets[0].config_path].arma3.mods,
+            core_api=kubernetes.client.CoreV1Api(
+                targets[0].api_client(args.api_client_settings)
+            ),
             logger=logger,
         )
+    elif args.command in ("export-arma3-mods", "import-arma3-mods"):
+        mods = configs[targets[0].config_path].arma3.mods
+        core_api = kubernetes.client.CoreV1Api(
+            targets[0].api_client(args.api_client_settings)
+        )
+        mod_cache = Path(args.mod_cache or Path(args.cache_dir) / "arma3-mods")
+        if args.command == "export-arma3-mods":
+            pods = _list_arma3_pods("server", core_api=core_api)
+            if not pods:
+                logger.error("No Arma 3 server Pod to export mods from")
+                sys.exit(1)
+            export_arma3_mods(
+                mods=mods,
+                pod=pods[0],
+                core_api=core_api,
+                cache_directory=mod_cache,
+                logger=logger,
+            )
+        else:
+            for component in ("server", "headless-client"):
+                for pod in _list_arma3_pods(component, core_api=core_api):
+                    import_arma3_mods(
+                        mods=mods,
+                        pod=pod,
+                        core_api=core_api,
+                        cache_directory=mod_cache,
+                        chunk_size=args.chunk_size * 1024 * 1024,
+                        logger=logger,
+                    )
+                    _record_arma3_mod_manifests(
+                        pod=pod, mods=mods, core_api=core_api, logger=logger
+                    )
+                    for mod in mods:
+                        _link_arma3_mod(
+                            pod=pod, mod=mod, core_api=core_api, logger=logger
+                        )
+                    _rebuild_arma3_lowercase_tree(
+                        pod=pod, core_api=core_api, logger=logger
+                    )
+            logger.info(
+                "Imported Arma 3 mods. Run `make arma3-update-mods` to download anything missing from the cache."
+            )
 
 
 if __name__ == "__main__":
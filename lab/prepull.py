@@ -0,0 +1,299 @@
+"""
+Pre-pulling of workload images.
+
+Pods pull their images as they are scheduled, so on a fresh cluster the
+rollout of workloads is bottlenecked on image pulls. Instead, a short-lived
+DaemonSet per image is created while the earlier phases of the deploy are
+applied, so the kubelet on every node pulls all the images up front. The
+DaemonSets' containers are never expected to run successfully; only their
+images matter.
+
+Each image gets its own Pod because the kubelet starts a Pod's containers,
+and so pulls their images, one after another. Separate Pods only pull
+concurrently if the kubelet's serializeImagePulls setting is false, which is
+not the default, including on k3s (set it with
+--kubelet-arg=serialize-image-pulls=false). Otherwise the pulls still happen
+before the workloads are scheduled, but one at a time; the setting is read
+from each Node's kubelet and logged.
+
+Pull times are taken from the kubelet's Pulled events, which report how long
+each pull took.
+"""
+import json
+import logging
+import re
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import kubernetes.client  # type: ignore
+import kubernetes.watch  # type: ignore
+
+from transforms import pod_spec
+
+NAME = "image-prepull"
+NAMESPACE = "kube-system"
+
+_PULLED = re.compile(
+    r"Successfully pulled image \"(?P<image>[^\"]+)\" in (?P<duration>([0-9.]+[a-zµ]+)+)"
+)
+_PRESENT = re.compile(r"Container image \"(?P<image>[^\"]+)\" already present")
+_FAILED = re.compile(r"Failed to pull image \"(?P<image>[^\"]+)\"")
+_DURATION = re.compile(r"([0-9.]+)(h|ms|m|s|us|µs|ns)")
+_DURATION_UNITS = {
+    "h": 3600,
+    "m": 60,
+    "s": 1,
+    "ms": 1e-3,
+    "us": 1e-6,
+    "µs": 1e-6,
+    "ns": 1e-9,
+}
+
+
+def workload_images(manifests: List[dict]) -> List[str]:
+    """
+    Return the deduplicated images of every container and init container in
+    the given workloads' Pod templates.
+    """
+    images = set()
+    for manifest in manifests:
+        spec = pod_spec(manifest)
+        if spec is None:
+            continue
+        for container in [*spec.get("initContainers", []), *spec["containers"]]:
+            images.add(container["image"])
+    return sorted(images)
+
+
+def _parse_duration(duration: str) -> float:
+    # e.g. "1m2.5s" or "850ms", as formatted by Go
+    return sum(
+        float(value) * _DURATION_UNITS[unit]
+        for value, unit in _DURATION.findall(duration)
+    )
+
+
+def _parse_event(message: str) -> Optional[Tuple[str, Optional[float]]]:
+    """
+    Parse the image and pull time from a kubelet event message. The pull time
+    is zero if the image was already present, or None if the pull failed.
+    """
+    if match := _PULLED.search(message):
+        return match.group("image"), _parse_duration(match.group("duration"))
+    if match := _PRESENT.search(message):
+        return match.group("image"), 0.0
+    if match := _FAILED.search(message):
+        return match.group("image"), None
+    return None
+
+
+def _daemon_set(index: int, image: str) -> dict:
+    name = f"{NAME}-{index}"
+    labels = {"app.kubernetes.io/name": NAME, "app.kubernetes.io/instance": name}
+    return {
+        "apiVersion": "apps/v1",
+        "kind": "DaemonSet",
+        "metadata": {"name": name, "namespace": NAMESPACE, "labels": labels},
+        "spec": {
+            "selector": {"matchLabels": labels},
+            "template": {
+                "metadata": {"labels": labels},
+                "spec": {
+                    "containers": [
+                        {
+                            "name": "image",
+                            "image": image,
+                            "imagePullPolicy": "IfNotPresent",
+                            # Most images have no true command, so the
+                            # container will fail to start after its image is
+                            # pulled. That's fine.
+                            "command": ["true"],
+                            "resources": {
+                                "requests": {"cpu": "1m", "memory": "1Mi"},
+                                "limits": {"cpu": "10m", "memory": "16Mi"},
+                            },
+                        }
+                    ],
+                    "terminationGracePeriodSeconds": 0,
+                    "tolerations": [{"operator": "Exists"}],
+                },
+            },
+        },
+    }
+
+
+def _serializes_image_pulls(
+    node: str, *, core_api: kubernetes.client.CoreV1Api
+) -> Optional[bool]:
+    """
+    Return the kubelet's serializeImagePulls setting on the given Node, or
+    None if its configuration cannot be read.
+    """
+    try:
+        response = core_api.connect_get_node_proxy_with_path(
+            node, "configz", _preload_content=False
+        )
+        configuration = json.loads(response.data)["kubeletconfig"]
+    except (kubernetes.client.rest.ApiException, KeyError, ValueError):
+        return None
+    # The kubelet's default
+    return configuration.get("serializeImagePulls", True)
+
+
+class ImagePrePull:  # pylint: disable=too-many-instance-attributes
+    """
+    Pre-pulls images with one DaemonSet per image. start() creates the
+    DaemonSets and returns immediately, and wait() waits for the pulls to
+    finish, reports the time taken to pull each image and deletes the
+    DaemonSets.
+    """
+
+    def __init__(
+        self,
+        images: List[str],
+        *,
+        api_client: kubernetes.client.ApiClient,
+        timeout: int,
+        logger: logging.Logger,
+    ) -> None:
+        self.images = images
+        self.apps_api = kubernetes.client.AppsV1Api(api_client)
+        self.core_api = kubernetes.client.CoreV1Api(api_client)
+        self.timeout = timeout
+        self.logger = logger
+        self.started = 0.0
+        self.uids: Set[str] = set()
+        self.pod_nodes: Dict[str, str] = {}
+        self.results: Dict[str, Dict[str, Optional[float]]] = {i: {} for i in images}
+
+    def _check_serialized_pulls(self) -> None:
+        try:
+            nodes = [n.metadata.name for n in self.core_api.list_node().items]
+        except kubernetes.client.rest.ApiException:
+            return
+        serialized = [
+            n
+            for n in nodes
+            if _serializes_image_pulls(n, core_api=self.core_api) is not False
+        ]
+        if serialized:
+            self.logger.info(
+                f"The kubelet on Node(s) {', '.join(serialized)} pulls one image at a time (serializeImagePulls is true or unknown), so images will be pulled early but not concurrently. Set the kubelet's serializeImagePulls to false to pull concurrently."
+            )
+
+    def start(self) -> None:
+        self.logger.info(f"Pre-pulling {len(self.images)} image(s)...")
+        self.started = time.monotonic()
+        self._check_serialized_pulls()
+        self.stop()
+        for i, image in enumerate(self.images):
+            daemon_set = self.apps_api.create_namespaced_daemon_set(
+                NAMESPACE, _daemon_set(i, image)
+            )
+            self.uids.add(daemon_set.metadata.uid)
+
+    def stop(self) -> None:
+        """
+        Delete the DaemonSets, including any left behind by an earlier
+        pre-pull.
+        """
+        selector = f"app.kubernetes.io/name={NAME}"
+        if not self.apps_api.list_namespaced_daemon_set(
+            NAMESPACE, label_selector=selector
+        ).items:
+            return
+        self.apps_api.delete_collection_namespaced_daemon_set(
+            NAMESPACE, label_selector=selector, grace_period_seconds=0
+        )
+        # Wait for the deletion to complete so the names can be reused
+        deadline = time.monotonic() + self.timeout
+        while self.apps_api.list_namespaced_daemon_set(
+            NAMESPACE, label_selector=selector
+        ).items:
+            if time.monotonic() >= deadline:
+                self.logger.warning(
+                    f"Timed out waiting for pre-pull DaemonSets in Namespace {NAMESPACE} to be deleted, continuing"
+                )
+                return
+            time.sleep(1)
+
+    def _node(self, pod: kubernetes.client.V1ObjectReference) -> Optional[str]:
+        """
+        Return the node of the given Pod, or None if the Pod does not belong
+        to this pre-pull.
+        """
+        if not pod.name.startswith(f"{NAME}-"):
+            return None
+        if pod.uid not in self.pod_nodes:
+            pods = self.core_api.list_namespaced_pod(
+                NAMESPACE, label_selector=f"app.kubernetes.io/name={NAME}"
+            ).items
+            self.pod_nodes = {
+                p.metadata.uid: p.spec.node_name
+                for p in pods
+                if any(o.uid in self.uids for o in p.metadata.owner_references or [])
+            }
+        return self.pod_nodes.get(pod.uid)
+
+    def _done(self) -> bool:
+        daemon_sets = self.apps_api.list_namespaced_daemon_set(
+            NAMESPACE, label_selector=f"app.kubernetes.io/name={NAME}"
+        ).items
+        desired = {
+            d.spec.template.spec.containers[0].image: d.status.desired_number_scheduled
+            for d in daemon_sets
+            if d.metadata.uid in self.uids
+        }
+        return all(
+            desired.get(image) and len(nodes) >= desired[image]
+            for image, nodes in self.results.items()
+        )
+
+    def wait(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """
+        Wait for every node to pull every image.
+
+        :return: The number of seconds each node took to pull each image,
+        keyed by image and then node. Images which failed to pull are None.
+        """
+        try:
+            remaining = self.timeout - (time.monotonic() - self.started)
+            watch = kubernetes.watch.Watch()
+            for event in watch.stream(
+                self.core_api.list_namespaced_event,
+                NAMESPACE,
+                field_selector="involvedObject.kind=Pod",
+                timeout_seconds=max(1, int(remaining)),
+            ):
+                node = self._node(event["object"].involved_object)
+                pulled = _parse_event(event["object"].message or "")
+                if node is None or pulled is None:
+                    continue
+                image, seconds = pulled
+                if seconds is None:
+                    self.logger.warning(
+                        f"Failed to pull image {image} on Node {node}: {event['object'].message}"
+                    )
+                if image in self.results:
+                    self.results[image].setdefault(node, seconds)
+                if self._done():
+                    watch.stop()
+                    break
+            else:
+                pending = [i for i, nodes in self.results.items() if not nodes]
+                self.logger.warning(
+                    f"Timed out pre-pulling images, continuing anyway. Not yet pulled on any Node: {', '.join(pending)}"
+                )
+        finally:
+            self.stop()
+
+        for image, nodes in sorted(self.results.items()):
+            times = [s for s in nodes.values() if s is not None]
+            if times:
+                self.logger.info(
+                    f"Image {image}: {max(times):.1f}s on {len(times)} Node(s)"
+                )
+        self.logger.info(
+            f"Pre-pulled {len(self.images)} image(s) in {time.monotonic() - self.started:.1f}s"
+        )
+        return self.results
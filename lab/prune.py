@@ -0,0 +1,339 @@
+"""
+Pruning of objects which have been removed from the manifests.
+
+Every object deployed is labelled as a member of the lab's apply set (see the
+apply_set_label transform), and the kinds of object in the apply set are
+recorded in a ConfigMap in the cluster. This is a simplified version of
+kubectl's ApplySets: the recorded kinds are what let a kind be pruned after
+every object of that kind has been removed from the manifests.
+
+The record also holds the manifest paths the apply set was deployed from.
+Pruning compares the cluster against the manifests being deployed, so it is
+refused unless exactly those paths are being deployed; otherwise e.g.
+deploying only deploy/teamspeak with --prune would delete everything else. It
+is also refused before any paths have been recorded.
+
+Orphans are found with one label-selected LIST per kind, rather than a GET
+per object, and any object not in the manifests being deployed is pruned.
+Objects with owner references are left alone, since their owners' controllers
+manage them. Orphans are deleted concurrently within each phase of the
+deploy, and the phases are deleted in reverse order, so that e.g. workloads
+are gone before the ServiceAccounts and ConfigMaps they use, and custom
+resources before their CustomResourceDefinitions. Objects in a Namespace
+being pruned are deleted along with their Namespace.
+"""
+import concurrent.futures
+import dataclasses
+import logging
+import os
+import time
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import kubernetes.client  # type: ignore
+import kubernetes.dynamic  # type: ignore
+
+from transforms import APPLY_SET, APPLY_SET_LABEL
+
+RECORD_NAME = "lab-apply-set"
+RECORD_NAMESPACE = "kube-system"
+
+# The phases of deploy_manifests, in the order they are applied. Kinds not
+# listed are applied last.
+PHASES = [
+    frozenset(["Namespace"]),
+    frozenset(["CustomResourceDefinition"]),
+    frozenset(["ClusterRole", "Role", "ServiceAccount"]),
+    frozenset(["ClusterRoleBinding", "RoleBinding"]),
+    frozenset(["ConfigMap", "Secret", "Service"]),
+]
+
+# (apiVersion, kind)
+Kind = Tuple[str, str]
+
+
+@dataclasses.dataclass(frozen=True)
+class Orphan:
+    api_version: str
+    kind: str
+    namespace: str
+    name: str
+
+    def __str__(self) -> str:
+        if self.namespace:
+            return f"{self.kind} {self.name} in Namespace {self.namespace}"
+        return f"{self.kind} {self.name}"
+
+
+def _key(api_version: str, kind: str, namespace: str, name: str) -> Tuple:
+    # Objects are the same whichever version of their API group they use
+    group = api_version.rpartition("/")[0]
+    return (group, kind, namespace, name)
+
+
+def _phase(kind: str) -> int:
+    for i, kinds in enumerate(PHASES):
+        if kind in kinds:
+            return i
+    return len(PHASES)
+
+
+def _kinds(manifests: Iterable[dict]) -> Set[Kind]:
+    return {(m["apiVersion"], m["kind"]) for m in manifests}
+
+
+def _roots(paths: Iterable[Path]) -> Set[str]:
+    """
+    Return the given manifest paths, normalized and without any path beneath
+    another.
+    """
+    roots = {PurePosixPath(os.path.normpath(p)) for p in paths}
+    return {str(r) for r in roots if not any(o in r.parents for o in roots)}
+
+
+@dataclasses.dataclass
+class ApplySetRecord:
+    kinds: Set[Kind]
+    # roots is the manifest paths the apply set was deployed from, or None
+    # if they have not been recorded.
+    roots: Optional[Set[str]]
+
+
+def _read_record(core_api: kubernetes.client.CoreV1Api) -> Optional[ApplySetRecord]:
+    try:
+        record = core_api.read_namespaced_config_map(RECORD_NAME, RECORD_NAMESPACE)
+    except kubernetes.client.rest.ApiException as e:
+        if e.status == 404:
+            return None
+        raise
+    data = record.data or {}
+    lines = data.get("kinds", "").splitlines()
+    return ApplySetRecord(
+        kinds={(v, k) for v, _, k in (line.partition(" ") for line in lines) if k},
+        roots=set(data["roots"].splitlines()) if "roots" in data else None,
+    )
+
+
+def _write_record(
+    record: ApplySetRecord, core_api: kubernetes.client.CoreV1Api
+) -> None:
+    config_map = kubernetes.client.V1ConfigMap(
+        metadata=kubernetes.client.V1ObjectMeta(
+            name=RECORD_NAME, namespace=RECORD_NAMESPACE
+        ),
+        data={
+            "kinds": "".join(f"{v} {k}\n" for v, k in sorted(record.kinds)),
+            "roots": "".join(f"{r}\n" for r in sorted(record.roots or ())),
+        },
+    )
+    try:
+        core_api.replace_namespaced_config_map(
+            RECORD_NAME, RECORD_NAMESPACE, config_map
+        )
+    except kubernetes.client.rest.ApiException as e:
+        if e.status != 404:
+            raise
+        core_api.create_namespaced_config_map(RECORD_NAMESPACE, config_map)
+
+
+def record_apply_set(
+    manifests: List[dict],
+    *,
+    paths: Sequence[Path],
+    api_client: kubernetes.client.ApiClient,
+    logger: logging.Logger,
+) -> None:
+    """
+    Add the kinds of the given manifests, and the paths they were loaded
+    from, to those recorded in the cluster. This is done before they are
+    applied, so that an interrupted deploy cannot leave objects of an
+    unrecorded kind behind.
+    """
+    core_api = kubernetes.client.CoreV1Api(api_client)
+    recorded = _read_record(core_api) or ApplySetRecord(kinds=set(), roots=None)
+    record = ApplySetRecord(
+        kinds=recorded.kinds | _kinds(manifests),
+        roots=_roots([*map(Path, recorded.roots or ()), *paths]),
+    )
+    if record != recorded:
+        logger.info(
+            f"Recording {len(record.kinds - recorded.kinds)} new kind(s) and manifest paths {', '.join(sorted(record.roots or ()))} in ConfigMap {RECORD_NAME} in Namespace {RECORD_NAMESPACE}..."
+        )
+        _write_record(record, core_api)
+
+
+def check_prunable(
+    paths: Sequence[Path], *, api_client: kubernetes.client.ApiClient
+) -> ApplySetRecord:
+    """
+    Raise an error unless the apply set was deployed from exactly the given
+    manifest paths, so that every object not in their manifests is an orphan.
+
+    :return: The recorded apply set.
+    """
+    record = _read_record(kubernetes.client.CoreV1Api(api_client))
+    if record is None or record.roots is None:
+        raise RuntimeError(
+            f"Not pruning: no manifest paths are recorded in ConfigMap {RECORD_NAME} in Namespace {RECORD_NAMESPACE} yet. Deploy once without --prune first."
+        )
+    roots = _roots(paths)
+    if roots != record.roots:
+        raise RuntimeError(
+            f"Not pruning: the apply set was deployed from {', '.join(sorted(record.roots))}, but {', '.join(sorted(roots))} was given. Deploy exactly the recorded paths to prune."
+        )
+    return record
+
+
+def _list_members(
+    kind: Kind, *, client: kubernetes.dynamic.DynamicClient, logger: logging.Logger
+) -> List[Orphan]:
+    api_version, name = kind
+    try:
+        resource = client.resources.get(api_version=api_version, kind=name)
+    except kubernetes.dynamic.exceptions.ResourceNotFoundError:
+        logger.warning(f"{api_version} {name} is no longer served, not pruning it")
+        return []
+    members = []
+    for item in resource.get(label_selector=f"{APPLY_SET_LABEL}={APPLY_SET}").items:
+        if item.metadata.ownerReferences:
+            continue
+        members.append(
+            Orphan(
+                api_version=api_version,
+                kind=name,
+                namespace=item.metadata.namespace or "",
+                name=item.metadata.name,
+            )
+        )
+    return members
+
+
+def find_orphans(
+    manifests: List[dict],
+    *,
+    client: kubernetes.dynamic.DynamicClient,
+    kinds: Set[Kind],
+    logger: logging.Logger,
+) -> List[Orphan]:
+    """
+    Return the members of the apply set of the given kinds which are not in
+    the given manifests, listing each kind concurrently.
+    """
+    wanted = {
+        _key(
+            m["apiVersion"],
+            m["kind"],
+            m["metadata"].get("namespace") or "",
+            m["metadata"]["name"],
+        )
+        for m in manifests
+    }
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        members = executor.map(
+            lambda k: _list_members(k, client=client, logger=logger), sorted(kinds)
+        )
+        found = {
+            m
+            for ms in members
+            for m in ms
+            if _key(m.api_version, m.kind, m.namespace, m.name) not in wanted
+        }
+    # The same object may be listed through several versions of its API
+    orphans: Dict[Tuple, Orphan] = {}
+    for orphan in sorted(found, key=lambda o: (_phase(o.kind), str(o))):
+        key = _key(orphan.api_version, orphan.kind, orphan.namespace, orphan.name)
+        orphans.setdefault(key, orphan)
+    return list(orphans.values())
+
+
+def _delete(
+    orphan: Orphan, *, client: kubernetes.dynamic.DynamicClient, dry_run: bool
+) -> None:
+    resource = client.resources.get(api_version=orphan.api_version, kind=orphan.kind)
+    try:
+        resource.delete(
+            name=orphan.name,
+            namespace=orphan.namespace or None,
+            propagation_policy="Background",
+            dry_run="All" if dry_run else None,
+        )
+    except kubernetes.dynamic.exceptions.NotFoundError:
+        pass
+
+
+def _wait_for_deletion(
+    orphans: List[Orphan],
+    *,
+    client: kubernetes.dynamic.DynamicClient,
+    timeout: int,
+    logger: logging.Logger,
+) -> None:
+    """
+    Wait for the given objects to be deleted, listing each kind rather than
+    reading each object.
+    """
+    remaining = set(orphans)
+    deadline = time.monotonic() + timeout
+    while remaining and time.monotonic() < deadline:
+        time.sleep(2)
+        kinds = {(o.api_version, o.kind) for o in remaining}
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            members = executor.map(
+                lambda k: _list_members(k, client=client, logger=logger), kinds
+            )
+            remaining &= {m for ms in members for m in ms}
+    for orphan in sorted(remaining, key=str):
+        logger.warning(f"Timed out waiting for {orphan} to be deleted, continuing")
+
+
+def prune(
+    manifests: List[dict],
+    *,
+    paths: Sequence[Path],
+    api_client: kubernetes.client.ApiClient,
+    dry_run: bool,
+    timeout: int,
+    logger: logging.Logger,
+) -> List[Orphan]:
+    # pylint: disable=too-many-arguments,too-many-locals
+    """
+    Delete the members of the apply set which are not in the given manifests,
+    which must have been loaded from the apply set's recorded paths. The
+    orphans are listed, and then checked with a server-side dry run before
+    anything is deleted. With dry_run, only the listing is done.
+
+    :return: The orphans found.
+    """
+    record = check_prunable(paths, api_client=api_client)
+    client = kubernetes.dynamic.DynamicClient(api_client)
+    kinds = record.kinds | _kinds(manifests)
+    logger.info(f"Listing {len(kinds)} kind(s) of object to find orphans...")
+    orphans = find_orphans(manifests, client=client, kinds=kinds, logger=logger)
+    for orphan in orphans:
+        logger.info(f"{'Would prune' if dry_run else 'Pruning'} {orphan}")
+    logger.info(f"Found {len(orphans)} object(s) to prune")
+    if dry_run:
+        return orphans
+
+    namespaces = {o.name for o in orphans if o.kind == "Namespace"}
+    deletions = [o for o in orphans if o.namespace not in namespaces]
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        list(executor.map(lambda o: _delete(o, client=client, dry_run=True), deletions))
+        phases = sorted({_phase(o.kind) for o in deletions}, reverse=True)
+        for phase in phases:
+            batch = [o for o in deletions if _phase(o.kind) == phase]
+            logger.info(f"Deleting {len(batch)} object(s)...")
+            list(
+                executor.map(lambda o: _delete(o, client=client, dry_run=False), batch)
+            )
+            # Later phases may be needed until this phase is fully deleted,
+            # e.g. by finalizers
+            if phase != phases[-1]:
+                _wait_for_deletion(batch, client=client, timeout=timeout, logger=logger)
+
+    _write_record(
+        ApplySetRecord(kinds=_kinds(manifests), roots=record.roots),
+        kubernetes.client.CoreV1Api(api_client),
+    )
+    logger.info(f"Pruned {len(orphans)} object(s)")
+    return orphans
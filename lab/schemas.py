@@ -0,0 +1,291 @@
+"""
+Offline validation of manifests against Kubernetes API schemas.
+
+A typo in a manifest would otherwise only be reported when kubectl apply
+fails, after any earlier phases of the deploy. Instead, every document is
+validated before anything is applied:
+
+- Built-in kinds are validated against JSON schemas derived from the models
+  of the Kubernetes Python client. Deriving them means introspecting every
+  model, so the result is cached on disk per client version.
+- Custom resources are validated against the OpenAPI schemas of the
+  CustomResourceDefinitions being deployed alongside them.
+
+Unknown fields in custom resources are rejected, as a strict apiserver would
+do. Unknown fields in built-in kinds are only reported as warnings, since
+the Python client's models may be older than the cluster's API, e.g. the
+locked client has no Service ipFamilies. Kinds without a schema, such as
+custom resources whose CRD is not being deployed, are not validated.
+"""
+import concurrent.futures
+import inspect
+import json
+import logging
+import re
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import jsonschema  # type: ignore
+import kubernetes.client  # type: ignore
+
+from transforms import object_identity
+
+# Resource quantities are strings in the API, but may be written as numbers
+_QUANTITY_FIELDS = frozenset(
+    [
+        "allocatable",
+        "capacity",
+        "default",
+        "defaultRequest",
+        "hard",
+        "limits",
+        "max",
+        "maxLimitRequestRatio",
+        "min",
+        "overhead",
+        "requests",
+        "sizeLimit",
+    ]
+)
+# Marks the schemas derived from the Python client's models
+_CLIENT_MODEL = "x-lab-client-model"
+_CONTAINER_TYPE = re.compile(r"^(list|dict)[\[(](?:str, )?(.*)[\])]$")
+_PRIMITIVE_TYPES = {
+    "str": {"type": "string"},
+    "int": {"type": "integer"},
+    "float": {"type": "number"},
+    "bool": {"type": "boolean"},
+    "datetime": {"type": "string"},
+    "date": {"type": "string"},
+    "object": {},
+}
+
+
+def _type_schema(openapi_type: str, *, quantity: bool = False) -> dict:
+    match = _CONTAINER_TYPE.match(openapi_type)
+    if match:
+        container, item_type = match.groups()
+        item_schema = _type_schema(item_type, quantity=quantity)
+        if container == "list":
+            return {"type": "array", "items": item_schema}
+        return {"type": "object", "additionalProperties": item_schema}
+    if openapi_type == "str" and quantity:
+        return {"type": ["string", "number"]}
+    if openapi_type in _PRIMITIVE_TYPES:
+        return dict(_PRIMITIVE_TYPES[openapi_type])
+    return {"$ref": f"#/definitions/{openapi_type}"}
+
+
+def _is_required(model: type, attribute: str) -> bool:
+    setter = getattr(model, attribute).fset
+    return setter is not None and "must not be `None`" in inspect.getsource(setter)
+
+
+def _core_definitions() -> Dict[str, dict]:
+    """
+    Derive a JSON schema for each model of the Kubernetes Python client.
+    """
+    definitions = {}
+    for name, model in inspect.getmembers(kubernetes.client, inspect.isclass):
+        openapi_types = getattr(model, "openapi_types", None)
+        if openapi_types is None:
+            continue
+        properties = {}
+        required = []
+        for attribute, openapi_type in openapi_types.items():
+            field = getattr(model, "attribute_map")[attribute]
+            properties[field] = _type_schema(
+                openapi_type, quantity=field in _QUANTITY_FIELDS
+            )
+            if _is_required(model, attribute):
+                required.append(field)
+        definitions[name] = {
+            "type": "object",
+            "properties": properties,
+            "additionalProperties": False,
+        }
+        if required:
+            definitions[name]["required"] = required
+    return definitions
+
+
+def load_core_definitions(cache_directory: Path) -> Dict[str, dict]:
+    """
+    Return the JSON schemas of the Kubernetes Python client's models, from
+    the on-disk cache if possible.
+    """
+    version = metadata.version("kubernetes")
+    path = cache_directory / f"kubernetes-{version}.json"
+    if path.is_file():
+        return json.loads(path.read_text())
+    definitions = _core_definitions()
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_suffix(".tmp")
+    temporary_path.write_text(json.dumps(definitions))
+    temporary_path.replace(path)
+    return definitions
+
+
+def _model_name(api_version: str, kind: str, definitions: Dict[str, dict]) -> str:
+    """
+    Return the name of the model for the given apiVersion and kind, e.g.
+    "V1Deployment" for apps/v1 Deployment. Kinds whose name is shared by
+    several API groups are disambiguated by group, e.g. "CoreV1Event".
+    """
+    group, _, version = api_version.rpartition("/")
+    version = version.capitalize()
+    prefix = group.split(".")[0].capitalize() if group else "Core"
+    if f"{prefix}{version}{kind}" in definitions:
+        return f"{prefix}{version}{kind}"
+    return f"{version}{kind}"
+
+
+def _crd_schema(schema: dict) -> dict:
+    """
+    Convert a CustomResourceDefinition's structural OpenAPI v3 schema to a
+    JSON schema which rejects unknown fields.
+    """
+    schema = dict(schema)
+    if schema.pop("x-kubernetes-int-or-string", False):
+        schema.pop("type", None)
+        schema.setdefault("anyOf", [{"type": "integer"}, {"type": "string"}])
+    if "properties" in schema:
+        schema["properties"] = {
+            k: _crd_schema(v) for k, v in schema["properties"].items()
+        }
+        if not schema.get("x-kubernetes-preserve-unknown-fields"):
+            schema.setdefault("additionalProperties", False)
+    if isinstance(schema.get("additionalProperties"), dict):
+        schema["additionalProperties"] = _crd_schema(schema["additionalProperties"])
+    if "items" in schema:
+        schema["items"] = _crd_schema(schema["items"])
+    for keyword in ("allOf", "anyOf", "oneOf"):
+        if keyword in schema:
+            schema[keyword] = [_crd_schema(s) for s in schema[keyword]]
+    return schema
+
+
+def _without_nulls(value: Any) -> Any:
+    # Null fields are treated as unset by kubectl
+    if isinstance(value, dict):
+        return {k: _without_nulls(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_without_nulls(v) for v in value]
+    return value
+
+
+class SchemaValidator:
+    """
+    Validates manifests against the schemas of built-in kinds and of the
+    custom resources defined by the given CustomResourceDefinitions.
+    Validators are compiled once per kind.
+    """
+
+    def __init__(self, *, definitions: Dict[str, dict], crds: List[dict]) -> None:
+        self.definitions = {
+            k: {**v, _CLIENT_MODEL: True} for k, v in definitions.items()
+        }
+        self.crd_schemas: Dict[Tuple[str, str], dict] = {}
+        for crd in crds:
+            group = crd["spec"]["group"]
+            kind = crd["spec"]["names"]["kind"]
+            for version in crd["spec"]["versions"]:
+                schema = version.get("schema", {}).get("openAPIV3Schema")
+                if schema is None:
+                    continue
+                schema = _crd_schema(schema)
+                schema.setdefault("properties", {})["metadata"] = {
+                    "$ref": "#/definitions/V1ObjectMeta"
+                }
+                self.crd_schemas[(f"{group}/{version['name']}", kind)] = schema
+        self._validators: Dict[Tuple[str, str], Optional[Any]] = {}
+
+    def _schema(self, api_version: str, kind: str) -> Optional[dict]:
+        if (api_version, kind) in self.crd_schemas:
+            return self.crd_schemas[(api_version, kind)]
+        name = _model_name(api_version, kind, self.definitions)
+        if name in self.definitions:
+            return {"$ref": f"#/definitions/{name}"}
+        return None
+
+    def compile(self, api_version: str, kind: str) -> Optional[Any]:
+        """
+        Return the validator for the given apiVersion and kind, or None if
+        there is no schema for it.
+        """
+        key = (api_version, kind)
+        if key not in self._validators:
+            schema = self._schema(api_version, kind)
+            if schema is None:
+                self._validators[key] = None
+            else:
+                self._validators[key] = jsonschema.Draft4Validator(
+                    {**schema, "definitions": self.definitions}
+                )
+        return self._validators[key]
+
+    def validate(self, manifest: dict) -> Tuple[List[str], List[str]]:
+        """
+        Return the problems with the given manifest, and the warnings about
+        fields unknown to the Python client's models. Both are empty if it is
+        valid or there is no schema for its kind.
+        """
+        validator = self.compile(manifest["apiVersion"], manifest["kind"])
+        problems: List[str] = []
+        warnings: List[str] = []
+        if validator is None:
+            return problems, warnings
+        for error in validator.iter_errors(_without_nulls(manifest)):
+            message = f"{'.'.join(str(p) for p in error.absolute_path) or '(root)'}: {error.message}"
+            if error.validator == "additionalProperties" and error.schema.get(
+                _CLIENT_MODEL
+            ):
+                warnings.append(message)
+            else:
+                problems.append(message)
+        return problems, warnings
+
+
+def validate_manifests(
+    manifests: List[dict],
+    *,
+    cache_directory: Path,
+    logger: logging.Logger,
+) -> List[str]:
+    """
+    Validate the given manifests concurrently. Problems are logged as errors
+    and returned, and warnings are logged.
+    """
+    validator = SchemaValidator(
+        definitions=load_core_definitions(cache_directory),
+        crds=[m for m in manifests if m["kind"] == "CustomResourceDefinition"],
+    )
+    # Compile validators up front rather than racing to compile them
+    unvalidated = set()
+    for manifest in manifests:
+        if validator.compile(manifest["apiVersion"], manifest["kind"]) is None:
+            unvalidated.add(f"{manifest['apiVersion']} {manifest['kind']}")
+    for kind in sorted(unvalidated):
+        logger.debug(f"No schema for {kind}, not validating")
+
+    def validate(manifest: dict) -> Tuple[List[str], List[str]]:
+        identity = object_identity(manifest)
+        problems, warnings = validator.validate(manifest)
+        return (
+            [f"{identity}: {p}" for p in problems],
+            [f"{identity}: {w}" for w in warnings],
+        )
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        results = list(executor.map(validate, manifests))
+    problems = [p for ps, _ in results for p in ps]
+    warnings = [w for _, ws in results for w in ws]
+    for warning in warnings:
+        logger.warning(f"{warning} (unknown to the Python client, not rejected)")
+    for problem in problems:
+        logger.error(problem)
+    logger.info(
+        f"Validated {len(manifests)} object(s): {len(problems)} problem(s) and {len(warnings)} warning(s) found"
+    )
+    return problems
@@ -0,0 +1,139 @@
+"""
+Clusters to deploy to.
+
+A target is a kubeconfig file and optionally a context within it, paired with
+the LabConfig that describes the lab running on that cluster. Manifests are
+rendered once per distinct LabConfig and then applied to every target using
+it concurrently, so that one slow or unreachable cluster does not hold up the
+others.
+"""
+import concurrent.futures
+import dataclasses
+import logging
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import kubernetes.client  # type: ignore
+
+from apiclient import ApiClientSettings, new_api_client
+
+
+@dataclasses.dataclass(frozen=True)
+class Target:
+    kubeconfig: Path
+    context: Optional[str]
+    config_path: Path
+
+    @property
+    def name(self) -> str:
+        if self.context:
+            return f"{self.kubeconfig}#{self.context}"
+        return str(self.kubeconfig)
+
+    def kubectl_args(self) -> List[str]:
+        """
+        Return the kubectl flags which select this target.
+        """
+        args = ["--kubeconfig", str(self.kubeconfig)]
+        if self.context:
+            args.extend(["--context", self.context])
+        return args
+
+    def api_client(self, settings: ApiClientSettings) -> kubernetes.client.ApiClient:
+        return new_api_client(
+            config_file=str(self.kubeconfig), context=self.context, settings=settings
+        )
+
+
+def resolve_targets(
+    *, kubeconfigs: Sequence[str], contexts: Sequence[str], configs: Sequence[str]
+) -> List[Target]:
+    """
+    Pair up the kubeconfig files, contexts and lab config files given on the
+    command line.
+
+    A single kubeconfig may be given with several contexts, otherwise each
+    kubeconfig is paired with the context in the same position. Likewise a
+    single lab config may be shared by every target, otherwise each target is
+    paired with the lab config in the same position.
+    """
+    pairs: List[Tuple[Path, Optional[str]]]
+    if not contexts:
+        pairs = [(Path(k), None) for k in kubeconfigs]
+    elif len(kubeconfigs) == 1:
+        pairs = [(Path(kubeconfigs[0]), c) for c in contexts]
+    elif len(kubeconfigs) == len(contexts):
+        pairs = [(Path(k), c) for k, c in zip(kubeconfigs, contexts)]
+    else:
+        raise ValueError(
+            "Give either one kubeconfig, no contexts, or one context per kubeconfig"
+        )
+
+    if len(configs) == 1:
+        config_paths = [Path(configs[0])] * len(pairs)
+    elif len(configs) == len(pairs):
+        config_paths = [Path(c) for c in configs]
+    else:
+        raise ValueError("Give either one lab config or one lab config per target")
+
+    return [
+        Target(kubeconfig=k, context=c, config_path=p)
+        for (k, c), p in zip(pairs, config_paths)
+    ]
+
+
+@dataclasses.dataclass
+class TargetResult:
+    target: Target
+    seconds: float
+    error: Optional[BaseException] = None
+
+
+def run_on_targets(
+    targets: Sequence[Target],
+    function: Callable[[Target], None],
+    *,
+    logger: logging.Logger,
+) -> List[TargetResult]:
+    """
+    Run the given function against each target concurrently. An exception
+    raised for one target does not affect the others.
+    """
+
+    def run(target: Target) -> TargetResult:
+        # pylint: disable=logging-fstring-interpolation
+        started = time.monotonic()
+        try:
+            function(target)
+        except Exception as e:  # pylint: disable=broad-except
+            target_logger(target, targets, logger=logger).error(f"Failed: {e}")
+            return TargetResult(target, time.monotonic() - started, e)
+        return TargetResult(target, time.monotonic() - started)
+
+    if len(targets) == 1:
+        results = [run(targets[0])]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(len(targets)) as executor:
+            results = list(executor.map(run, targets))
+
+    for result in results:
+        if result.error is None:
+            logger.info(f"{result.target.name}: succeeded in {result.seconds:.1f}s")
+        else:
+            logger.error(
+                f"{result.target.name}: failed after {result.seconds:.1f}s: {result.error}"
+            )
+    return results
+
+
+def target_logger(
+    target: Target, targets: Sequence[Target], *, logger: logging.Logger
+) -> logging.Logger:
+    """
+    Return the logger to use for the given target. Log messages are only
+    attributed to targets when there is more than one.
+    """
+    if len(targets) == 1:
+        return logger
+    return logging.getLogger(target.name)
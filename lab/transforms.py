@@ -0,0 +1,225 @@
+"""
+Registry of the customizations applied to manifests before they are deployed.
+
+Each customization is a transform pass: a function which modifies a manifest
+in place and returns the number of changes it made. Passes are indexed by the
+kinds of object they apply to, so each manifest only visits the passes which
+can apply to it, and may further be restricted to a Namespace and set of
+names or disabled entirely depending on the LabConfig.
+
+Rather than logging every change, run_transforms() records how many objects
+each pass visited and changed and how long it took, and logs a summary.
+"""
+import dataclasses
+import logging
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional
+
+from config import LabConfig
+
+TransformFunction = Callable[[dict, LabConfig], int]
+
+
+@dataclasses.dataclass(frozen=True)
+class TransformPass:
+    name: str
+    function: TransformFunction
+    # kinds is the set of kinds the pass applies to, or empty for all kinds.
+    kinds: FrozenSet[str] = frozenset()
+    # namespace restricts the pass to objects in the given Namespace.
+    namespace: Optional[str] = None
+    # names restricts the pass to objects with the given names.
+    names: FrozenSet[str] = frozenset()
+    # enabled decides whether the pass runs at all for a given LabConfig.
+    enabled: Callable[[LabConfig], bool] = lambda _: True
+
+    def applies_to(self, manifest: dict) -> bool:
+        metadata = manifest["metadata"]
+        if self.namespace is not None and metadata.get("namespace") != self.namespace:
+            return False
+        if self.names and metadata["name"] not in self.names:
+            return False
+        return True
+
+
+@dataclasses.dataclass
+class TransformStats:
+    visited: int = 0
+    changed: int = 0
+    changes: int = 0
+    seconds: float = 0.0
+
+
+_registry: List[TransformPass] = []
+
+
+def register(transform_pass: TransformPass) -> None:
+    _registry.append(transform_pass)
+
+
+def transform(
+    *kinds: str,
+    namespace: Optional[str] = None,
+    names: Iterable[str] = (),
+    enabled: Callable[[LabConfig], bool] = lambda _: True,
+) -> Callable[[TransformFunction], TransformFunction]:
+    """
+    Decorator which registers a function as a transform pass.
+    """
+
+    def decorator(function: TransformFunction) -> TransformFunction:
+        register(
+            TransformPass(
+                name=function.__name__.lstrip("_"),
+                function=function,
+                kinds=frozenset(kinds),
+                namespace=namespace,
+                names=frozenset(names),
+                enabled=enabled,
+            )
+        )
+        return function
+
+    return decorator
+
+
+def run_transforms(
+    manifests: List[dict],
+    *,
+    config: LabConfig,
+    logger: logging.Logger,
+    extra_passes: Iterable[TransformPass] = (),
+) -> List[dict]:
+    """
+    Run every enabled transform pass over the manifests which it applies to.
+    """
+    passes = [p for p in (*_registry, *extra_passes) if p.enabled(config)]
+    # Index the passes by kind, preserving registration order
+    by_kind: Dict[str, List[TransformPass]] = {}
+    stats = {p.name: TransformStats() for p in passes}
+
+    for manifest in manifests:
+        kind = manifest["kind"]
+        if kind not in by_kind:
+            by_kind[kind] = [p for p in passes if not p.kinds or kind in p.kinds]
+        for transform_pass in by_kind[kind]:
+            if not transform_pass.applies_to(manifest):
+                continue
+            pass_stats = stats[transform_pass.name]
+            started = time.perf_counter()
+            changes = transform_pass.function(manifest, config)
+            pass_stats.seconds += time.perf_counter() - started
+            pass_stats.visited += 1
+            if changes:
+                pass_stats.changed += 1
+                pass_stats.changes += changes
+                logger.debug(
+                    f"Customized {object_identity(manifest)} with {transform_pass.name}"
+                )
+
+    for name, pass_stats in stats.items():
+        logger.info(
+            f"Customization {name}: changed {pass_stats.changed} of {pass_stats.visited} object(s) ({pass_stats.changes} change(s)) in {pass_stats.seconds * 1000:.2f}ms"
+        )
+    return manifests
+
+
+def object_identity(manifest: dict) -> str:
+    """
+    Return a description of the given object for messages, e.g.
+    "Service grafana in Namespace monitoring".
+    """
+    identity = f"{manifest['kind']} {manifest['metadata']['name']}"
+    if manifest["metadata"].get("namespace"):
+        identity += f" in Namespace {manifest['metadata']['namespace']}"
+    return identity
+
+
+def pod_spec(manifest: dict) -> Optional[dict]:
+    """
+    Return the Pod spec of the given workload, or None if the object does not
+    have a Pod template.
+    """
+    kind = manifest["kind"]
+    if kind == "Pod":
+        return manifest["spec"]
+    if kind == "CronJob":
+        return manifest["spec"]["jobTemplate"]["spec"]["template"]["spec"]
+    if kind in ("Deployment", "StatefulSet", "DaemonSet", "ReplicaSet", "Job"):
+        return manifest["spec"]["template"]["spec"]
+    return None
+
+
+@transform("Deployment", "StatefulSet", "Job", "CronJob")
+def _image_pull_policy(manifest: dict, _: LabConfig) -> int:
+    # Set image pull policy to IfNotPresent to conserve network bandwidth
+    spec = pod_spec(manifest)
+    assert spec is not None
+    changes = 0
+    for container in spec["containers"]:
+        if container.get("imagePullPolicy") != "IfNotPresent":
+            container["imagePullPolicy"] = "IfNotPresent"
+            changes += 1
+    return changes
+
+
+@transform("Ingress")
+def _ingress_tls(manifest: dict, config: LabConfig) -> int:
+    # https://cert-manager.io/docs/usage/ingress/
+    spec = manifest["spec"]
+    host = config.nginx.base_url.host
+    changes = 0
+    if spec.get("ingressClassName") != "nginx":
+        spec["ingressClassName"] = "nginx"
+        changes += 1
+    annotations = manifest["metadata"].setdefault("annotations", {})
+    if (
+        annotations.get("cert-manager.io/cluster-issuer")
+        != config.cert_manager.issuer.value
+    ):
+        annotations["cert-manager.io/cluster-issuer"] = config.cert_manager.issuer.value
+        changes += 1
+    tls = [
+        {"hosts": [host], "secretName": f"{manifest['metadata']['name']}-ingress-tls"}
+    ]
+    if spec.get("tls") != tls:
+        spec["tls"] = tls
+        changes += 1
+    for rule in spec.get("rules", []):
+        if rule.get("host") != host:
+            rule["host"] = host
+            changes += 1
+    return changes
+
+
+@transform(
+    "StatefulSet",
+    namespace="arma3",
+    names=("arma3", "arma3-headless-client"),
+    enabled=lambda config: bool(config.arma3.mods),
+)
+def _arma3_mods(manifest: dict, config: LabConfig) -> int:
+    # Add Arma 3 mods to arma3server arguments
+    changes = 0
+    for container in manifest["spec"]["template"]["spec"]["containers"]:
+        if container["name"] == "arma3":
+            container["args"].append(
+                "-mod=" + ";".join(f"@{mod.name}" for mod in config.arma3.mods)
+            )
+            changes += 1
+    return changes
+
+
+# Every deployed object is labelled as a member of the lab's apply set, so
+# objects removed from the manifests can be found and pruned
+APPLY_SET_LABEL = "homelab.dharmab.com/apply-set"
+APPLY_SET = "lab"
+
+
+@transform()
+def _apply_set_label(manifest: dict, _: LabConfig) -> int:
+    labels = manifest["metadata"].get("labels") or {}
+    if labels.get(APPLY_SET_LABEL) == APPLY_SET:
+        return 0
+    manifest["metadata"]["labels"] = {**labels, APPLY_SET_LABEL: APPLY_SET}
+    return 1
@@ -0,0 +1,273 @@
+"""
+Usage-driven container resource requests and limits.
+
+When enabled in the LabConfig, the historical p95 CPU and memory usage of
+every container is queried from Prometheus, or read from a recorded usage
+file, and used to set the requests and limits of the matching containers in
+the workloads being deployed. Requests are p95 usage plus headroom, limits
+are a multiple of the requests, and both are clamped to configured bounds.
+
+A usage file is a JSON list of containers' p95 usage, with CPU in cores and
+memory in bytes:
+
+[
+  {
+    "namespace": "monitoring",
+    "pod": "grafana-7f8b9c6d4-x2x9q",
+    "container": "grafana",
+    "cpu": 0.012,
+    "memory": 104857600
+  }
+]
+"""
+import dataclasses
+import functools
+import json
+import logging
+import math
+import re
+import ssl
+import urllib.parse
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+from config import Issuer, LabConfig, Resources
+from transforms import TransformPass, object_identity, pod_spec
+
+_POD_NAME_SUFFIXES = {
+    "Deployment": r"-[a-z0-9]{6,10}-[a-z0-9]{5}",
+    "StatefulSet": r"-[0-9]+",
+    "DaemonSet": r"-[a-z0-9]{5}",
+}
+
+
+@dataclasses.dataclass
+class ContainerUsage:
+    namespace: str
+    pod: str
+    container: str
+    # cpu is p95 CPU usage in cores.
+    cpu: float
+    # memory is p95 memory working set in bytes.
+    memory: float
+
+
+def _query_prometheus(
+    url: str, query: str, *, context: Optional[ssl.SSLContext]
+) -> Dict[Tuple[str, str, str], float]:
+    with urllib.request.urlopen(
+        f"{url}/api/v1/query?{urllib.parse.urlencode({'query': query})}",
+        timeout=30,
+        context=context,
+    ) as response:
+        body = json.load(response)
+    return {
+        (
+            r["metric"]["namespace"],
+            r["metric"]["pod"],
+            r["metric"]["container"],
+        ): float(r["value"][1])
+        for r in body["data"]["result"]
+    }
+
+
+def load_usage(config: LabConfig, *, logger: logging.Logger) -> List[ContainerUsage]:
+    """
+    Load containers' p95 usage from the configured usage file or Prometheus.
+    Usage is only loaded once per process for each source.
+    """
+    settings = config.resources
+    if settings.usage_file is not None:
+        logger.info(f"Loading container usage from {settings.usage_file}...")
+        return _read_usage_file(str(settings.usage_file))
+    url = str(settings.prometheus_url or f"{config.nginx.base_url}/prometheus")
+    logger.info(f"Querying {settings.window} of container usage from {url}...")
+    return _query_usage(
+        url,
+        settings.window,
+        verify=config.cert_manager.issuer != Issuer.SELF_SIGNED,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _read_usage_file(path: str) -> List[ContainerUsage]:
+    with open(path, encoding="utf-8") as f:
+        return [ContainerUsage(**u) for u in json.load(f)]
+
+
+@functools.lru_cache(maxsize=None)
+def _query_usage(url: str, window: str, *, verify: bool) -> List[ContainerUsage]:
+    context = None
+    if not verify:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    selector = 'container!="", container!="POD"'
+    cpu = _query_prometheus(
+        url,
+        f"quantile_over_time(0.95, sum by (namespace, pod, container) (rate(container_cpu_usage_seconds_total{{{selector}}}[5m]))[{window}:5m])",
+        context=context,
+    )
+    memory = _query_prometheus(
+        url,
+        f"max by (namespace, pod, container) (quantile_over_time(0.95, container_memory_working_set_bytes{{{selector}}}[{window}]))",
+        context=context,
+    )
+    return [
+        ContainerUsage(
+            namespace=namespace,
+            pod=pod,
+            container=container,
+            cpu=cpu[(namespace, pod, container)],
+            memory=memory[(namespace, pod, container)],
+        )
+        for namespace, pod, container in sorted(cpu.keys() & memory.keys())
+    ]
+
+
+def _clamp(value: int, minimum: int, maximum: int) -> int:
+    return max(minimum, min(maximum, value))
+
+
+def _describe(resources: dict) -> str:
+    parts = []
+    for section in ("requests", "limits"):
+        values = resources.get(section) or {}
+        if values:
+            parts.append(
+                f"{section} "
+                + " ".join(f"{k}={values[k]}" for k in ("cpu", "memory") if k in values)
+            )
+    return ", ".join(parts) or "none"
+
+
+def _millicores(quantity: str) -> float:
+    if quantity.endswith("m"):
+        return float(quantity[:-1])
+    return float(quantity) * 1000
+
+
+def _merge(resources: dict, recommended: dict) -> dict:
+    """
+    Return the given container resources with the recommended CPU and memory
+    requests and limits merged in. Other resources, and a CPU limit when none
+    is recommended, are kept, though a kept CPU limit is raised to at least
+    the new request.
+    """
+    merged = dict(resources)
+    for section in ("requests", "limits"):
+        merged[section] = {
+            **(resources.get(section) or {}),
+            **recommended.get(section, {}),
+        }
+    requests, limits = merged["requests"], merged["limits"]
+    if "cpu" in limits and _millicores(str(limits["cpu"])) < _millicores(
+        requests["cpu"]
+    ):
+        limits["cpu"] = requests["cpu"]
+    return merged
+
+
+def recommend(cpu: float, memory: float, settings: Resources) -> dict:
+    """
+    Return the requests and limits for a container with the given p95 usage.
+    """
+    cpu_request = _clamp(
+        math.ceil(cpu * settings.cpu_headroom * 1000),
+        settings.min_cpu_millicores,
+        settings.max_cpu_millicores,
+    )
+    memory_request = _clamp(
+        math.ceil(memory * settings.memory_headroom / 2**20),
+        settings.min_memory_mib,
+        settings.max_memory_mib,
+    )
+    memory_limit = max(
+        memory_request,
+        _clamp(
+            math.ceil(memory_request * settings.memory_limit_ratio),
+            settings.min_memory_mib,
+            settings.max_memory_mib,
+        ),
+    )
+    resources = {
+        "requests": {"cpu": f"{cpu_request}m", "memory": f"{memory_request}Mi"},
+        "limits": {"memory": f"{memory_limit}Mi"},
+    }
+    if settings.cpu_limit_ratio is not None:
+        cpu_limit = max(
+            cpu_request,
+            _clamp(
+                math.ceil(cpu_request * settings.cpu_limit_ratio),
+                settings.min_cpu_millicores,
+                settings.max_cpu_millicores,
+            ),
+        )
+        resources["limits"]["cpu"] = f"{cpu_limit}m"
+    return resources
+
+
+class UsageResources:
+    """
+    A transform pass which sets container resources from usage, and records
+    a report of the changes it made.
+    """
+
+    def __init__(self, usage: List[ContainerUsage], *, settings: Resources) -> None:
+        self.settings = settings
+        self.usage: Dict[Tuple[str, str], List[ContainerUsage]] = {}
+        for u in usage:
+            self.usage.setdefault((u.namespace, u.container), []).append(u)
+        self.report: List[str] = []
+        self.missing: List[str] = []
+        self.transform_pass = TransformPass(
+            name="usage_resources",
+            function=self._transform,
+            kinds=frozenset(_POD_NAME_SUFFIXES),
+        )
+
+    def _transform(self, manifest: dict, _: LabConfig) -> int:
+        metadata = manifest["metadata"]
+        namespace = metadata.get("namespace", "default")
+        pod_name = re.compile(
+            re.escape(metadata["name"]) + _POD_NAME_SUFFIXES[manifest["kind"]] + "$"
+        )
+        spec = pod_spec(manifest)
+        assert spec is not None
+        changes = 0
+        for container in spec["containers"]:
+            identity = f"{object_identity(manifest)}, container {container['name']}"
+            usage = [
+                u
+                for u in self.usage.get((namespace, container["name"]), [])
+                if pod_name.match(u.pod)
+            ]
+            if not usage:
+                self.missing.append(identity)
+                continue
+            cpu = max(u.cpu for u in usage)
+            memory = max(u.memory for u in usage)
+            resources = _merge(
+                container.get("resources") or {},
+                recommend(cpu, memory, self.settings),
+            )
+            before = _describe(container.get("resources") or {})
+            after = _describe(resources)
+            if before == after:
+                continue
+            container["resources"] = resources
+            changes += 1
+            self.report.append(
+                f"{identity}: p95 cpu={cpu * 1000:.0f}m memory={memory / 2**20:.0f}Mi; {before} -> {after}"
+            )
+        return changes
+
+    def log_report(self, logger: logging.Logger) -> None:
+        for line in self.report:
+            logger.info(f"Resources for {line}")
+        if self.missing:
+            logger.info(
+                f"No usage data for {len(self.missing)} container(s), left unchanged"
+            )
+            for identity in self.missing:
+                logger.debug(f"No usage data for {identity}")
@@ -0,0 +1,212 @@
+"""
+Continuously re-render and apply manifests as they are edited.
+
+Linux only: file changes are detected using inotify(7) via ctypes.
+"""
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+import pydantic
+
+from config import LabConfig
+from index import object_key, walk_manifest_files
+
+# https://man7.org/linux/man-pages/man7/inotify.7.html
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    Minimal inotify(7) binding which watches directories for files being
+    written, created, moved or deleted.
+    """
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.directories: Dict[int, Path] = {}
+
+    def add_watch(self, directory: Path) -> None:
+        if directory in self.directories.values():
+            return
+        wd = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), ctypes.c_uint32(self.mask)
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(directory))
+        self.directories[wd] = directory
+
+    def read(self, timeout: Optional[float]) -> List[Path]:
+        """
+        Wait up to the given number of seconds for events.
+
+        :return: Paths of the files or directories which changed.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        buffer = os.read(self.fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if wd not in self.directories:
+                continue
+            path = self.directories[wd] / os.fsdecode(name)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_watch(path)
+            paths.append(path)
+        return paths
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def _fingerprint(manifest: dict) -> str:
+    return hashlib.sha256(
+        json.dumps(manifest, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _is_editor_artifact(path: Path) -> bool:
+    return path.name.startswith(".") or path.name.endswith(("~", ".swp", ".tmp"))
+
+
+def watch_manifests(
+    paths: Sequence[Path],
+    *,
+    config_path: Path,
+    config: LabConfig,
+    render: Callable[[Path, LabConfig], List[dict]],
+    apply: Callable[[List[dict], LabConfig], None],
+    debounce: float,
+    logger: logging.Logger,
+) -> None:
+    # pylint: disable=too-many-arguments,too-many-branches,too-many-locals,too-many-statements
+    """
+    Apply the manifests at the given paths, then watch the paths and the lab
+    config file for changes. After each burst of changes has settled for
+    `debounce` seconds, only the affected files are re-rendered and only the
+    objects which differ from the last applied state are applied. A config
+    change re-renders every file, since both templates and customizations
+    depend on the config.
+
+    :param render: Function which loads and customizes the objects in a file.
+    :param apply: Function which deploys a list of objects.
+    """
+    inotify = Inotify()
+    for path in paths:
+        if path.is_dir():
+            inotify.add_watch(path)
+            for directory in (p for p in path.rglob("*") if p.is_dir()):
+                inotify.add_watch(directory)
+        else:
+            inotify.add_watch(path.parent)
+    config_path = config_path.resolve()
+    inotify.add_watch(config_path.parent)
+
+    def is_manifest(path: Path) -> bool:
+        return not _is_editor_artifact(path) and any(
+            p == path or p in path.parents for p in paths
+        )
+
+    # Objects from each file, keyed by object key then fingerprint of the
+    # object as last applied
+    applied: Dict[Path, Dict[str, str]] = {}
+
+    def sync(files: Set[Path]) -> None:
+        changed: List[dict] = []
+        rendered: Dict[Path, Dict[str, str]] = {}
+        for path in sorted(files):
+            if not path.is_file():
+                if applied.pop(path, None):
+                    logger.warning(
+                        f"{path} was removed. Its objects have been left in the cluster."
+                    )
+                continue
+            previous = applied.get(path, {})
+            current = rendered[path] = {}
+            for manifest in render(path, config):
+                key = object_key(manifest)
+                current[key] = _fingerprint(manifest)
+                if previous.get(key) != current[key]:
+                    changed.append(manifest)
+            for key in previous.keys() - current.keys():
+                logger.warning(
+                    f"{key} was removed from {path}. It has been left in the cluster."
+                )
+        if changed:
+            apply(changed, config)
+        else:
+            logger.info("No objects changed")
+        # Only record state once it has been applied, so that a failed apply
+        # is retried on the next change
+        applied.update(rendered)
+
+    sync(set(walk_manifest_files(paths)))
+    logger.info(f"Watching {len(inotify.directories)} directories for changes...")
+    try:
+        while True:
+            events = set(inotify.read(None))
+            # Debounce: keep collecting events until the burst settles
+            while True:
+                more = inotify.read(debounce)
+                if not more:
+                    break
+                events.update(more)
+
+            files: Set[Path] = set()
+            for path in events:
+                if path.resolve() == config_path:
+                    logger.info(f"Reloading lab config {config_path}...")
+                    try:
+                        config = LabConfig.parse_file(config_path)
+                    except (pydantic.ValidationError, ValueError) as e:
+                        logger.error(f"Ignoring invalid lab config: {e}")
+                        continue
+                    files.update(walk_manifest_files(paths))
+                elif is_manifest(path):
+                    if path.is_dir():
+                        files.update(walk_manifest_files([path]))
+                    else:
+                        files.add(path)
+            if not files:
+                continue
+
+            logger.info(f"Re-rendering {len(files)} changed file(s)...")
+            started = time.monotonic()
+            try:
+                sync(files)
+            except Exception as e:  # pylint: disable=broad-except
+                # Keep watching so the next edit can fix the problem
+                logger.error(f"Failed to deploy changes: {e}")
+                continue
+            logger.info(f"Deployed changes in {time.monotonic() - started:.1f}s")
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
+    finally:
+        inotify.close()
@@ -0,0 +1,14 @@
+import sys
+from pathlib import Path
+
+from _pytest.terminal import TerminalReporter
+
+# The lab scripts are not a package; make their modules importable by tests
+sys.path.insert(0, str(Path(__file__).parent.parent / "lab"))
+
+from apiclient import METRICS  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def pytest_terminal_summary(terminalreporter: TerminalReporter) -> None:
+    for line in METRICS.summary(histograms=True):
+        terminalreporter.write_line(line)
@@ -0,0 +1,119 @@
+import json
+import socket
+from pathlib import Path
+from typing import Any, Optional, Tuple
+from unittest import mock
+
+import kubernetes.client  # type: ignore
+import pytest
+
+from apiclient import (
+    ApiClientSettings,
+    ApiMetrics,
+    InstrumentedApiClient,
+    _describe_request,
+    new_api_client,
+)
+
+SERVER = "https://127.0.0.1:6443"
+
+
+@pytest.mark.parametrize(
+    "method,path,query_params,expected",
+    [
+        ("GET", "/api/v1/namespaces", [], ("list", "namespaces")),
+        ("GET", "/api/v1/namespaces/monitoring", [], ("get", "namespaces")),
+        ("GET", "/api/v1/namespaces/monitoring/pods", [], ("list", "pods")),
+        ("GET", "/api/v1/namespaces/monitoring/pods/grafana-0", [], ("get", "pods")),
+        (
+            "GET",
+            "/api/v1/namespaces/arma3/pods/arma3-0/exec?command=true",
+            [],
+            ("get", "pods/exec"),
+        ),
+        (
+            "POST",
+            "/api/v1/namespaces/kube-system/configmaps",
+            [],
+            ("create", "configmaps"),
+        ),
+        (
+            "PATCH",
+            "/apis/apps/v1/namespaces/monitoring/deployments/grafana/status",
+            [],
+            ("patch", "deployments/status"),
+        ),
+        (
+            "DELETE",
+            "/apis/apps/v1/namespaces/kube-system/daemonsets/image-prepull",
+            [],
+            ("delete", "daemonsets"),
+        ),
+        (
+            "GET",
+            "/apis/apiextensions.k8s.io/v1/customresourcedefinitions",
+            [("watch", True), ("timeoutSeconds", 60)],
+            ("watch", "customresourcedefinitions"),
+        ),
+        (
+            "GET",
+            "/apis/apiextensions.k8s.io/v1/customresourcedefinitions",
+            None,
+            ("list", "customresourcedefinitions"),
+        ),
+        ("GET", "/version", [], ("get", "/version")),
+    ],
+)
+def test_describe_request(
+    method: str, path: str, query_params: Any, expected: Tuple[str, str]
+) -> None:
+    assert _describe_request(method, f"{SERVER}{path}", query_params) == expected
+
+
+@pytest.mark.parametrize(
+    "query_params,timeout",
+    [
+        ([], (5.0, 60.0)),
+        # The dynamic client never preloads responses, but they are not streams
+        ([("labelSelector", "app=grafana")], (5.0, 60.0)),
+        ([("watch", True), ("timeoutSeconds", 60)], None),
+        ([("follow", "true")], None),
+    ],
+)
+def test_request_timeout(query_params: Any, timeout: Optional[Tuple]) -> None:
+    api_client = InstrumentedApiClient(
+        kubernetes.client.Configuration(),
+        settings=ApiClientSettings(),
+        metrics=ApiMetrics(),
+    )
+    with mock.patch.object(kubernetes.client.ApiClient, "request") as request:
+        api_client.request(
+            "GET",
+            f"{SERVER}/api/v1/namespaces/monitoring/pods",
+            query_params=query_params,
+            _preload_content=False,
+        )
+    assert request.call_args.kwargs.get("_request_timeout") == timeout
+
+
+def test_keep_alive(tmp_path: Path) -> None:
+    kubeconfig = tmp_path / "kubeconfig.yaml"
+    kubeconfig.write_text(
+        json.dumps(
+            {
+                "apiVersion": "v1",
+                "kind": "Config",
+                "clusters": [{"name": "lab", "cluster": {"server": SERVER}}],
+                "users": [{"name": "lab", "user": {"token": "token"}}],
+                "contexts": [
+                    {"name": "lab", "context": {"cluster": "lab", "user": "lab"}}
+                ],
+                "current-context": "lab",
+            }
+        )
+    )
+    api_client = new_api_client(config_file=str(kubeconfig))
+    socket_options = api_client.rest_client.pool_manager.connection_pool_kw[
+        "socket_options"
+    ]
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in socket_options
@@ -0,0 +1,54 @@
+import pytest
+
+from apply_errors import (
+    PermanentApplyError,
+    TransientApplyError,
+    WebhookNotReadyError,
+    classify_apply_error,
+)
+
+
+def test_webhook_connection_refused_is_webhook_not_ready() -> None:
+    error = classify_apply_error(
+        'Error from server (InternalError): error when creating "STDIN": Internal error occurred: failed calling webhook "webhook.cert-manager.io": failed to call webhook: Post "https://cert-manager-webhook.cert-manager.svc:443/mutate?timeout=10s": dial tcp 10.43.12.3:443: connect: connection refused\n'
+    )
+    assert isinstance(error, WebhookNotReadyError)
+    assert error.webhooks == {"webhook.cert-manager.io"}
+    assert error.services == {("cert-manager", "cert-manager-webhook")}
+
+
+@pytest.mark.parametrize(
+    "stderr",
+    [
+        'error: unable to recognize "STDIN": no matches for kind "ClusterIssuer" in version "cert-manager.io/v1"\n',
+        'error: resource mapping not found for name: "letsencrypt" namespace: "" from "STDIN": no matches for kind "ClusterIssuer" in version "cert-manager.io/v1"\nensure CRDs are installed first\n',
+        'Error from server (Forbidden): error when creating "STDIN": configmaps "grafana-config" is forbidden: unable to create new content in namespace monitoring because it is being terminated\n',
+        "The connection to the server 127.0.0.1:6443 was refused - did you specify the right host or port?\n",
+        'error: error validating "STDIN": error validating data: failed to download openapi: Get "https://127.0.0.1:6443/openapi/v2?timeout=32s": dial tcp 127.0.0.1:6443: connect: connection refused; if you choose to ignore these errors, turn validation off with --validate=false\n',
+        "Unable to connect to the server: net/http: TLS handshake timeout\n",
+        "Unable to connect to the server: dial tcp 192.168.122.10:6443: i/o timeout\n",
+        'Error from server (InternalError): error when creating "STDIN": Post "https://127.0.0.1:6443/api/v1/namespaces/monitoring/configmaps": unexpected EOF\n',
+    ],
+)
+def test_transient(stderr: str) -> None:
+    error = classify_apply_error(stderr)
+    assert isinstance(error, TransientApplyError)
+    assert not isinstance(error, WebhookNotReadyError)
+
+
+@pytest.mark.parametrize(
+    "stderr",
+    [
+        'The Deployment "grafana" is invalid: spec.selector: Invalid value: v1.LabelSelector{MatchLabels:map[string]string{"app.kubernetes.io/name":"grafana"}, MatchExpressions:[]v1.LabelSelectorRequirement(nil)}: field is immutable\n',
+        'Error from server (Forbidden): error when creating "STDIN": admission webhook "validate.nginx.ingress.kubernetes.io" denied the request: host "grafana.example.com" and path "/" is already defined in ingress monitoring/grafana\n',
+        'error: error validating "STDIN": error validating data: ValidationError(Deployment.spec): missing required field "selector" in io.k8s.api.apps.v1.DeploymentSpec; if you choose to ignore these errors, turn validation off with --validate=false\n',
+        'Error from server (BadRequest): error when creating "STDIN": Deployment in version "v1" cannot be handled as a Deployment: strict decoding error: unknown field "spec.template.spec.containers[0].imagePullPolicyy"\n',
+    ],
+)
+def test_permanent(stderr: str) -> None:
+    assert isinstance(classify_apply_error(stderr), PermanentApplyError)
+
+
+def test_message_is_first_line() -> None:
+    error = classify_apply_error("\nerror: something went wrong\nmore detail\n")
+    assert str(error) == "kubectl apply failed: error: something went wrong"
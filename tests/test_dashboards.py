@@ -0,0 +1,40 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import dashboards
+from dashboards import is_dashboard, load_dashboard
+
+
+def test_load_dashboard(tmp_path: Path) -> None:
+    path = tmp_path / "node-exporter.dashboard.json"
+    path.write_text(
+        json.dumps(
+            {"title": "Nodes", "panels": [{"legendFormat": "{{ instance }}"}]},
+            indent=4,
+        ),
+        encoding="utf-8",
+    )
+    assert is_dashboard(path)
+    config_map = load_dashboard(path)
+    assert config_map["metadata"]["name"] == "grafana-dashboard-node-exporter"
+    assert config_map["metadata"]["namespace"] == "monitoring"
+    assert config_map["metadata"]["labels"]["app.kubernetes.io/version"] == "8.2.2"
+    # Minified, and the legend template is left alone
+    assert config_map["data"] == {
+        "node-exporter.json": '{"title":"Nodes","panels":[{"legendFormat":"{{ instance }}"}]}'
+    }
+
+
+def test_is_dashboard() -> None:
+    assert not is_dashboard(Path("grafana-dashboardDefinitions.yaml"))
+    assert not is_dashboard(Path("dashboard.json"))
+
+
+def test_dashboard_over_budget(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dashboards, "MAX_DASHBOARD_BYTES", 16)
+    path = tmp_path / "large.dashboard.json"
+    path.write_text(json.dumps({"title": "x" * 16}), encoding="utf-8")
+    with pytest.raises(ValueError, match="exceeds the 16 byte ConfigMap budget"):
+        load_dashboard(path)
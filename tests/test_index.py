@@ -0,0 +1,38 @@
+import pytest
+
+from index import LabelSelector
+
+
+@pytest.mark.parametrize(
+    "selector,labels,expected",
+    [
+        ("app=grafana", {"app": "grafana"}, True),
+        ("app==grafana", {"app": "grafana"}, True),
+        ("app=grafana", {"app": "prometheus"}, False),
+        ("app=grafana", {}, False),
+        ("tier!=frontend", {"tier": "backend"}, True),
+        ("tier!=frontend", {}, True),
+        ("tier!=frontend", {"tier": "frontend"}, False),
+        ("legacy", {"legacy": ""}, True),
+        ("legacy", {}, False),
+        ("!legacy", {}, True),
+        ("!legacy", {"legacy": "true"}, False),
+        (
+            "app.kubernetes.io/name=grafana, tier!=frontend, !legacy",
+            {"app.kubernetes.io/name": "grafana", "tier": "backend"},
+            True,
+        ),
+        ("", {"app": "grafana"}, True),
+    ],
+)
+def test_label_selector_matches(selector: str, labels: dict, expected: bool) -> None:
+    assert LabelSelector(selector).matches(labels) is expected
+
+
+@pytest.mark.parametrize(
+    "selector",
+    ["tier in (a,b)", "tier notin (a)", "app=graf ana", "-app=grafana", "app=-"],
+)
+def test_label_selector_rejects_unsupported(selector: str) -> None:
+    with pytest.raises(ValueError):
+        LabelSelector(selector)
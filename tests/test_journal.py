@@ -0,0 +1,135 @@
+import logging
+from pathlib import Path
+
+import pytest
+
+from config import LabConfig
+from journal import DeployJournal, deploy_fingerprint
+
+LOGGER = logging.getLogger(__name__)
+NAMESPACE = {"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "lab"}}
+SERVICE = {
+    "apiVersion": "v1",
+    "kind": "Service",
+    "metadata": {"name": "lab", "namespace": "lab"},
+}
+
+
+@pytest.fixture(name="config")
+def setup_config() -> LabConfig:
+    return LabConfig.parse_obj(
+        {
+            "cert_manager": {
+                "email": "lab@example.com",
+                "cloudflare_api_token": "token",
+            },
+            "nginx": {"base_url": "https://lab.example.com"},
+            "arma3": {
+                "hostname": "lab",
+                "admin_password": "admin",
+                "server_password": "server",
+                "server_command_password": "command",
+                "steamcmd": {"username": "steam", "password": "steam"},
+            },
+        }
+    )
+
+
+def test_deploy_fingerprint(tmp_path: Path, config: LabConfig) -> None:
+    manifest_directory = tmp_path / "deploy"
+    manifest_directory.mkdir()
+    (manifest_directory / "b.yaml").write_text("b")
+    (manifest_directory / "a.yaml").write_text("a")
+    paths = [manifest_directory]
+    fingerprint = deploy_fingerprint(
+        paths, config=config, manifests=[NAMESPACE, SERVICE]
+    )
+    # The order of the manifests does not matter
+    assert fingerprint == deploy_fingerprint(
+        paths, config=config, manifests=[SERVICE, NAMESPACE]
+    )
+    # The selected objects, the files' contents and the config all do
+    assert fingerprint != deploy_fingerprint(
+        paths, config=config, manifests=[NAMESPACE]
+    )
+    (manifest_directory / "a.yaml").write_text("changed")
+    changed = deploy_fingerprint(paths, config=config, manifests=[NAMESPACE, SERVICE])
+    assert changed != fingerprint
+    other_config = config.copy(
+        update={"nginx": config.nginx.copy(update={"base_url": "https://other"})}
+    )
+    assert changed != deploy_fingerprint(
+        paths, config=other_config, manifests=[NAMESPACE, SERVICE]
+    )
+
+
+def test_resume(tmp_path: Path) -> None:
+    journal = DeployJournal.start(
+        tmp_path, target="lab", fingerprint="a", resume=False, logger=LOGGER
+    )
+    journal.complete("Namespace", [NAMESPACE])
+
+    resumed = DeployJournal.start(
+        tmp_path, target="lab", fingerprint="a", resume=True, logger=LOGGER
+    )
+    assert resumed.is_complete("Namespace")
+    assert not resumed.is_complete("final")
+    assert resumed.remaining([NAMESPACE, SERVICE]) == [SERVICE]
+
+
+def test_journals_are_per_target(tmp_path: Path) -> None:
+    journal = DeployJournal.start(
+        tmp_path, target="lab", fingerprint="a", resume=False, logger=LOGGER
+    )
+    journal.complete("Namespace", [NAMESPACE])
+    other = DeployJournal.start(
+        tmp_path, target="other", fingerprint="a", resume=True, logger=LOGGER
+    )
+    assert not other.phases
+
+
+def test_fingerprint_mismatch_starts_over(tmp_path: Path) -> None:
+    journal = DeployJournal.start(
+        tmp_path, target="lab", fingerprint="a", resume=False, logger=LOGGER
+    )
+    journal.complete("Namespace", [NAMESPACE])
+    resumed = DeployJournal.start(
+        tmp_path, target="lab", fingerprint="b", resume=True, logger=LOGGER
+    )
+    assert not resumed.phases and not resumed.objects
+    assert resumed.fingerprint == "b"
+
+
+def test_not_resuming_starts_over(tmp_path: Path) -> None:
+    journal = DeployJournal.start(
+        tmp_path, target="lab", fingerprint="a", resume=False, logger=LOGGER
+    )
+    journal.complete("Namespace", [NAMESPACE])
+    assert not DeployJournal.start(
+        tmp_path, target="lab", fingerprint="a", resume=False, logger=LOGGER
+    ).phases
+
+
+def test_unreadable_journal_starts_over(tmp_path: Path) -> None:
+    journal = DeployJournal.start(
+        tmp_path, target="lab", fingerprint="a", resume=False, logger=LOGGER
+    )
+    for path in tmp_path.iterdir():
+        path.write_text("{not json")
+    resumed = DeployJournal.start(
+        tmp_path, target="lab", fingerprint="a", resume=True, logger=LOGGER
+    )
+    assert not resumed.phases
+    journal.remove()
+
+
+def test_removed_journal_cannot_be_resumed(tmp_path: Path) -> None:
+    journal = DeployJournal.start(
+        tmp_path, target="lab", fingerprint="a", resume=False, logger=LOGGER
+    )
+    journal.complete("Namespace", [NAMESPACE])
+    journal.remove()
+    assert not list(tmp_path.iterdir())
+    assert not DeployJournal.start(
+        tmp_path, target="lab", fingerprint="a", resume=True, logger=LOGGER
+    ).phases
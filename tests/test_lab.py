@@ -1,7 +1,6 @@
 from typing import Optional, Sequence, Tuple
 
 import kubernetes.client  # type: ignore
-import kubernetes.config  # type: ignore
 import pytest
 from kubernetes.client import AppsV1Api, CoreV1Api
 from kubernetes.client.models import (  # type: ignore
@@ -12,20 +11,22 @@ from kubernetes.client.models import (  # type: ignore
     V1StatefulSet,
 )
 
+from apiclient import new_api_client
 
-@pytest.fixture(autouse=True, scope="session")
-def load_kube_config() -> None:
-    kubernetes.config.load_kube_config()
+
+@pytest.fixture(scope="session", name="api_client")
+def setup_api_client() -> kubernetes.client.ApiClient:
+    return new_api_client()
 
 
 @pytest.fixture(scope="session", name="core_api")
-def setup_core_api() -> CoreV1Api:
-    return CoreV1Api()
+def setup_core_api(api_client: kubernetes.client.ApiClient) -> CoreV1Api:
+    return CoreV1Api(api_client)
 
 
 @pytest.fixture(scope="session", name="apps_api")
-def setup_apps_api() -> CoreV1Api:
-    return AppsV1Api()
+def setup_apps_api(api_client: kubernetes.client.ApiClient) -> AppsV1Api:
+    return AppsV1Api(api_client)
 
 
 @pytest.fixture(name="all_namespaces")
@@ -0,0 +1,58 @@
+import logging
+from typing import Optional, Tuple
+from unittest import mock
+
+import kubernetes.client  # type: ignore
+import pytest
+
+from prepull import ImagePrePull, _parse_event
+
+
+@pytest.mark.parametrize(
+    "message,expected",
+    [
+        (
+            'Successfully pulled image "grafana/grafana:8.2.2" in 12.345678901s',
+            ("grafana/grafana:8.2.2", 12.345678901),
+        ),
+        (
+            'Successfully pulled image "quay.io/prometheus/prometheus:v2.30.3" in 1m2.5s',
+            ("quay.io/prometheus/prometheus:v2.30.3", 62.5),
+        ),
+        (
+            'Successfully pulled image "busybox:1.34" in 850ms (850ms including waiting)',
+            ("busybox:1.34", 0.85),
+        ),
+        (
+            'Container image "grafana/grafana:8.2.2" already present on machine',
+            ("grafana/grafana:8.2.2", 0.0),
+        ),
+        (
+            'Failed to pull image "grafana/grafana:0.0.0": rpc error: code = NotFound desc = failed to pull and unpack image',
+            ("grafana/grafana:0.0.0", None),
+        ),
+        ('Pulling image "grafana/grafana:8.2.2"', None),
+        ("Started container image-0", None),
+    ],
+)
+def test_parse_event(
+    message: str, expected: Optional[Tuple[str, Optional[float]]]
+) -> None:
+    assert _parse_event(message) == pytest.approx(expected)
+
+
+def test_stop_gives_up_on_a_stuck_deletion() -> None:
+    pre_pull = ImagePrePull(
+        ["busybox:1.34"],
+        api_client=kubernetes.client.ApiClient(),
+        timeout=0,
+        logger=logging.getLogger(__name__),
+    )
+    with mock.patch.object(
+        pre_pull.apps_api, "list_namespaced_daemon_set"
+    ) as list_daemon_sets, mock.patch.object(
+        pre_pull.apps_api, "delete_collection_namespaced_daemon_set"
+    ) as delete_daemon_sets:
+        list_daemon_sets.return_value.items = [mock.Mock()]
+        pre_pull.stop()
+    delete_daemon_sets.assert_called_once()
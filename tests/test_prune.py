@@ -0,0 +1,18 @@
+from pathlib import Path
+
+from prune import _roots
+
+
+def test_roots_are_normalized() -> None:
+    assert _roots([Path("./deploy/teamspeak/"), Path("deploy/arma3")]) == {
+        "deploy/teamspeak",
+        "deploy/arma3",
+    }
+
+
+def test_roots_drop_nested_paths() -> None:
+    assert _roots(
+        [Path("deploy/teamspeak"), Path("deploy"), Path("deploy/monitoring.yaml")]
+    ) == {"deploy"}
+    # A shared prefix is not nesting
+    assert _roots([Path("deploy"), Path("deployments")]) == {"deploy", "deployments"}
@@ -0,0 +1,119 @@
+import logging
+from pathlib import Path
+
+from config import LabConfig
+from main import customize_manifests, parse_manifests
+from schemas import SchemaValidator, _crd_schema, validate_manifests
+
+DEPLOY = Path(__file__).parent.parent / "deploy"
+
+
+def test_crd_schema_rejects_unknown_fields() -> None:
+    schema = {
+        "type": "object",
+        "properties": {
+            "spec": {
+                "type": "object",
+                "properties": {
+                    "replicas": {"type": "integer"},
+                    "ports": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {"port": {"type": "integer"}},
+                        },
+                    },
+                },
+            },
+        },
+    }
+    converted = _crd_schema(schema)
+    assert converted["additionalProperties"] is False
+    spec = converted["properties"]["spec"]
+    assert spec["additionalProperties"] is False
+    assert spec["properties"]["ports"]["items"]["additionalProperties"] is False
+    # The original schema is left as it was
+    assert "additionalProperties" not in schema
+
+
+def test_crd_schema_preserves_unknown_fields() -> None:
+    converted = _crd_schema(
+        {
+            "type": "object",
+            "x-kubernetes-preserve-unknown-fields": True,
+            "properties": {"name": {"type": "string"}},
+        }
+    )
+    assert "additionalProperties" not in converted
+
+
+def test_crd_schema_int_or_string() -> None:
+    assert _crd_schema({"x-kubernetes-int-or-string": True}) == {
+        "anyOf": [{"type": "integer"}, {"type": "string"}]
+    }
+
+
+def test_crd_schema_converts_nested_schemas() -> None:
+    converted = _crd_schema(
+        {
+            "type": "object",
+            "additionalProperties": {
+                "type": "object",
+                "properties": {"value": {"x-kubernetes-int-or-string": True}},
+            },
+            "properties": {},
+            "anyOf": [{"type": "object", "properties": {"a": {"type": "string"}}}],
+        }
+    )
+    values = converted["additionalProperties"]
+    assert values["additionalProperties"] is False
+    assert values["properties"]["value"] == {
+        "anyOf": [{"type": "integer"}, {"type": "string"}]
+    }
+    assert converted["anyOf"][0]["additionalProperties"] is False
+
+
+def test_unknown_fields_in_built_in_kinds_are_warnings() -> None:
+    validator = SchemaValidator(
+        definitions={
+            "V1ConfigMap": {
+                "type": "object",
+                "properties": {"data": {"type": "object"}},
+                "additionalProperties": False,
+            }
+        },
+        crds=[],
+    )
+    problems, warnings = validator.validate(
+        {"apiVersion": "v1", "kind": "ConfigMap", "data": [], "newField": 1}
+    )
+    assert problems == ["data: [] is not of type 'object'"]
+    assert len(warnings) == 1 and "newField" in warnings[0]
+
+
+def test_rendered_deploy_tree_is_valid(tmp_path: Path) -> None:
+    config = LabConfig.parse_obj(
+        {
+            "cert_manager": {
+                "email": "lab@example.com",
+                "cloudflare_api_token": "token",
+            },
+            "nginx": {"base_url": "https://lab.example.com"},
+            "arma3": {
+                "hostname": "lab",
+                "admin_password": "admin",
+                "server_password": "server",
+                "server_command_password": "command",
+                "steamcmd": {"username": "steam", "password": "steam"},
+                "mods": [{"name": "cba_a3", "workshop_id": 450814997}],
+            },
+        }
+    )
+    logger = logging.getLogger(__name__)
+    manifests = customize_manifests(
+        parse_manifests([DEPLOY], config=config, logger=logger),
+        config=config,
+        logger=logger,
+    )
+    assert manifests
+    assert not validate_manifests(manifests, cache_directory=tmp_path, logger=logger)
@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import pytest
+
+from targets import Target, resolve_targets
+
+
+def test_kubeconfigs_without_contexts() -> None:
+    assert resolve_targets(
+        kubeconfigs=["a.yaml", "b.yaml"], contexts=[], configs=["lab.json"]
+    ) == [
+        Target(kubeconfig=Path("a.yaml"), context=None, config_path=Path("lab.json")),
+        Target(kubeconfig=Path("b.yaml"), context=None, config_path=Path("lab.json")),
+    ]
+
+
+def test_one_kubeconfig_with_several_contexts() -> None:
+    targets = resolve_targets(
+        kubeconfigs=["kubeconfig"],
+        contexts=["home", "work"],
+        configs=["home.json", "work.json"],
+    )
+    assert [t.name for t in targets] == ["kubeconfig#home", "kubeconfig#work"]
+    assert [t.config_path for t in targets] == [Path("home.json"), Path("work.json")]
+    assert targets[0].kubectl_args() == [
+        "--kubeconfig",
+        "kubeconfig",
+        "--context",
+        "home",
+    ]
+
+
+def test_kubeconfigs_paired_with_contexts() -> None:
+    targets = resolve_targets(
+        kubeconfigs=["a.yaml", "b.yaml"], contexts=["x", "y"], configs=["lab.json"]
+    )
+    assert [(t.kubeconfig, t.context) for t in targets] == [
+        (Path("a.yaml"), "x"),
+        (Path("b.yaml"), "y"),
+    ]
+
+
+def test_mismatched_contexts() -> None:
+    with pytest.raises(ValueError):
+        resolve_targets(
+            kubeconfigs=["a.yaml", "b.yaml"],
+            contexts=["x", "y", "z"],
+            configs=["lab.json"],
+        )
+
+
+def test_mismatched_configs() -> None:
+    with pytest.raises(ValueError):
+        resolve_targets(
+            kubeconfigs=["a.yaml", "b.yaml", "c.yaml"],
+            contexts=[],
+            configs=["a.json", "b.json"],
+        )
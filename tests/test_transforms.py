@@ -0,0 +1,122 @@
+import logging
+from typing import List
+
+import pytest
+
+import transforms
+from config import LabConfig
+from transforms import TransformPass, _ingress_tls, object_identity, run_transforms
+
+LOGGER = logging.getLogger(__name__)
+
+
+@pytest.fixture(name="config")
+def setup_config() -> LabConfig:
+    return LabConfig.parse_obj(
+        {
+            "cert_manager": {
+                "email": "lab@example.com",
+                "cloudflare_api_token": "token",
+            },
+            "nginx": {"base_url": "https://lab.example.com"},
+            "arma3": {
+                "hostname": "lab",
+                "admin_password": "admin",
+                "server_password": "server",
+                "server_command_password": "command",
+                "steamcmd": {"username": "steam", "password": "steam"},
+            },
+        }
+    )
+
+
+def _manifest(kind: str, name: str, namespace: str = "lab") -> dict:
+    return {
+        "apiVersion": "v1",
+        "kind": kind,
+        "metadata": {"name": name, "namespace": namespace},
+    }
+
+
+def _recorder(visited: List[str]) -> transforms.TransformFunction:
+    def record(manifest: dict, _: LabConfig) -> int:
+        visited.append(object_identity(manifest))
+        return 1
+
+    return record
+
+
+def test_passes_are_restricted(
+    config: LabConfig, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(transforms, "_registry", [])
+    by_kind: List[str] = []
+    by_name: List[str] = []
+    disabled: List[str] = []
+    run_transforms(
+        [
+            _manifest("Service", "grafana"),
+            _manifest("ConfigMap", "grafana"),
+            _manifest("Service", "prometheus", namespace="monitoring"),
+        ],
+        config=config,
+        logger=LOGGER,
+        extra_passes=[
+            TransformPass(
+                name="by_kind",
+                function=_recorder(by_kind),
+                kinds=frozenset(["Service"]),
+            ),
+            TransformPass(
+                name="by_name",
+                function=_recorder(by_name),
+                namespace="monitoring",
+                names=frozenset(["prometheus"]),
+            ),
+            TransformPass(
+                name="disabled", function=_recorder(disabled), enabled=lambda _: False
+            ),
+        ],
+    )
+    assert by_kind == [
+        "Service grafana in Namespace lab",
+        "Service prometheus in Namespace monitoring",
+    ]
+    assert by_name == ["Service prometheus in Namespace monitoring"]
+    assert not disabled
+
+
+def test_stats_are_logged(
+    config: LabConfig,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    monkeypatch.setattr(transforms, "_registry", [])
+    caplog.set_level(logging.INFO)
+    run_transforms(
+        [_manifest("Service", "a"), _manifest("Service", "b")],
+        config=config,
+        logger=LOGGER,
+        extra_passes=[
+            TransformPass(
+                name="only_a",
+                function=lambda m, _: 2 if m["metadata"]["name"] == "a" else 0,
+            )
+        ],
+    )
+    assert "Customization only_a: changed 1 of 2 object(s) (2 change(s))" in caplog.text
+
+
+def test_ingress_tls_counts_changes(config: LabConfig) -> None:
+    ingress: dict = {
+        "apiVersion": "networking.k8s.io/v1",
+        "kind": "Ingress",
+        "metadata": {"name": "grafana", "namespace": "monitoring"},
+        "spec": {"rules": [{"host": "grafana.local"}, {"host": "lab.example.com"}]},
+    }
+    # ingressClassName, the issuer annotation, tls and one rule's host
+    assert _ingress_tls(ingress, config) == 4
+    assert ingress["spec"]["tls"] == [
+        {"hosts": ["lab.example.com"], "secretName": "grafana-ingress-tls"}
+    ]
+    assert _ingress_tls(ingress, config) == 0
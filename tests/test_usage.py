@@ -0,0 +1,50 @@
+from typing import Any, Dict
+
+from config import Resources
+from usage import _merge, recommend
+
+
+def test_recommend_applies_headroom() -> None:
+    assert recommend(0.1, 100 * 2**20, Resources()) == {
+        "requests": {"cpu": "125m", "memory": "125Mi"},
+        "limits": {"memory": "188Mi"},
+    }
+
+
+def test_recommend_clamps_to_minimum() -> None:
+    assert recommend(0.0, 0.0, Resources()) == {
+        "requests": {"cpu": "10m", "memory": "32Mi"},
+        "limits": {"memory": "48Mi"},
+    }
+
+
+def test_recommend_clamps_to_maximum() -> None:
+    assert recommend(100.0, 64 * 2**30, Resources()) == {
+        "requests": {"cpu": "4000m", "memory": "8192Mi"},
+        "limits": {"memory": "8192Mi"},
+    }
+
+
+def test_recommend_cpu_limit() -> None:
+    resources = recommend(0.1, 100 * 2**20, Resources(cpu_limit_ratio=2.0))
+    assert resources["limits"] == {"cpu": "250m", "memory": "188Mi"}
+
+
+def test_merge_keeps_other_resources() -> None:
+    resources: Dict[str, Dict[str, Any]] = {
+        "requests": {"cpu": "100m", "memory": "128Mi", "ephemeral-storage": "1Gi"},
+        "limits": {"cpu": "2", "memory": "256Mi", "nvidia.com/gpu": 1},
+    }
+    assert _merge(resources, recommend(0.1, 100 * 2**20, Resources())) == {
+        "requests": {"cpu": "125m", "memory": "125Mi", "ephemeral-storage": "1Gi"},
+        "limits": {"cpu": "2", "memory": "188Mi", "nvidia.com/gpu": 1},
+    }
+    # The original resources are left as they were
+    assert resources["requests"]["cpu"] == "100m"
+
+
+def test_merge_raises_cpu_limit_to_request() -> None:
+    merged = _merge(
+        {"limits": {"cpu": "100m"}}, recommend(0.4, 100 * 2**20, Resources())
+    )
+    assert merged["limits"]["cpu"] == merged["requests"]["cpu"] == "500m"